@@ -3,16 +3,23 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import cm
 
-def plot_goodput_surface_swapped(csv_file="simulation_results.csv"):
-    # Load the simulation results
+def load_summary(summary_file="simulation_summary.csv", csv_file="simulation_results.csv"):
+    """Per-(W, L) mean goodput: the sweep's pre-aggregated summary, or a groupby over the full results."""
     try:
-        df = pd.read_csv(csv_file)
+        return pd.read_csv(summary_file, usecols=['W', 'L', 'goodput'])
     except FileNotFoundError:
-        print(f"Error: {csv_file} not found.")
-        return
-
+        pass
+    df = pd.read_csv(csv_file)
     # Average the goodput over 10 seeds
-    avg_results = df.groupby(['W', 'L'])['goodput'].mean().reset_index()
+    return df.groupby(['W', 'L'])['goodput'].mean().reset_index()
+
+def plot_goodput_surface_swapped(csv_file="simulation_results.csv", summary_file="simulation_summary.csv"):
+    # Load the per-point means
+    try:
+        avg_results = load_summary(summary_file, csv_file)
+    except FileNotFoundError:
+        print(f"Error: neither {summary_file} nor {csv_file} found.")
+        return
 
     # Pivot the data
     # Index: W, Columns: L
@@ -0,0 +1,243 @@
+# benchmark.py - Performance benchmarks with output checks and JSON baselines
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from config import DEFAULT_PARAMS
+from layers.link import LinkLayer
+from layers.physical import BlockPhysicalLayer, PhysicalLayer
+from layers.transport import TransportLayer
+from models import Segment
+from validate import run_stats
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, "benchmarks", "baseline.json")
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.25  # Relative slowdown flagged by compare (timings are noisy)
+
+ENGINE_POINTS = [(8, 512), (32, 1024), (64, 4096)]
+ENGINE_DATA_SIZE = 2 * 1024 * 1024  # Reduced transfer for end-to-end runs
+
+# Deterministic payload, so checksum-dependent outputs are reproducible
+_PAYLOAD = bytes(range(256)) * (ENGINE_DATA_SIZE // 256)
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registers a benchmark: a function running the workload once and returning its output."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+# === END-TO-END ===
+
+def _engine_benchmark(W, L, app_drain):
+    def run():
+        return run_stats(W, L, 0, _PAYLOAD, app_drain=app_drain)
+    return run
+
+for _W, _L in ENGINE_POINTS:
+    benchmark(f"engine_W{_W}_L{_L}")(_engine_benchmark(_W, _L, "fluid"))
+benchmark("engine_W32_L1024_tick")(_engine_benchmark(32, 1024, "tick"))
+
+
+# === LINK LAYER ===
+
+def _filled_link(window_size, n_frames, spacing=0.001):
+    """LinkLayer with the first n_frames (<= window_size) sent spacing seconds apart."""
+    link = LinkLayer(window_size)
+    segment = Segment(0, b"")
+    for i in range(n_frames):
+        link.create_frame(segment, i * spacing)
+    return link
+
+
+@benchmark("link_process_ack")
+def bench_process_ack():
+    """Slides a W=64 window over 50k frames, acknowledging each group of 8 in reverse."""
+    link = LinkLayer(64)
+    segment = Segment(0, b"")
+    now = 0.0
+    for base in range(0, 50_000, 8):
+        while link.can_send():
+            link.create_frame(segment, now)
+        now += 0.001
+        for seq in range(base + 7, base - 1, -1):
+            link.process_ack(seq, now + 0.05)
+    return [link.send_base, link.timeout_interval]
+
+
+@benchmark("link_receive_frame")
+def bench_receive_frame():
+    """Delivers 50k frames to a W=64 receiver, each window's frames pairwise swapped."""
+    link = LinkLayer(64)
+    delivered = 0
+    for base in range(0, 50_000, 64):
+        for i in range(0, 64, 2):
+            for seq in (base + i + 1, base + i):
+                in_order, _ = link.receive_frame(seq, b"", 0)
+                delivered += len(in_order)
+    return [delivered, link.recv_base]
+
+
+@benchmark("link_get_timed_out_frames")
+def bench_get_timed_out_frames():
+    """Scans a full W=1024 window every millisecond, retransmitting what expires."""
+    link = _filled_link(1024, 1024)
+    expired = 0
+    now = 0.0
+    for _ in range(5_000):
+        now += 0.001
+        for seq in link.get_timed_out_frames(now):
+            link.prepare_retransmit(seq, now)
+            expired += 1
+    return [expired]
+
+
+# === PHYSICAL LAYER ===
+
+FRAME_BYTES = DEFAULT_PARAMS.frame_bytes(1024)
+
+@benchmark("physical_check_error")
+def bench_check_error():
+    phy = PhysicalLayer(seed=0)
+    return [sum(phy.check_error(FRAME_BYTES) for _ in range(200_000))]
+
+
+@benchmark("physical_check_error_block")
+def bench_check_error_block():
+    phy = BlockPhysicalLayer(seed=0)
+    return [sum(phy.check_error(FRAME_BYTES) for _ in range(200_000))]
+
+
+# === TRANSPORT LAYER ===
+
+@benchmark("transport_segmentize")
+def bench_segmentize():
+    """Segments the payload, touches every segment and checksums it."""
+    transport = TransportLayer(512)
+    segments = transport.segmentize(_PAYLOAD)
+    total = sum(len(segments[i].data) for i in range(len(segments)))
+    transport.precompute_checksums()
+    return [len(segments), total, sum(transport.checksums)]
+
+
+@benchmark("transport_app_consume")
+def bench_app_consume():
+    """Fills the receive buffer in order and drains it with 1 ms reads, 20k segments."""
+    transport = TransportLayer(1024)
+    data = bytes(1024)
+    seq = 0
+    while seq < 20_000:
+        while transport.can_accept(len(data)) and seq < 20_000:
+            transport.receive_segment(seq, data)
+            seq += 1
+        transport.app_consume(1250)
+    while transport.app_consume(1250):
+        pass
+    return [transport.delivered_count, transport.current_buffer_usage]
+
+
+# === DRIVER ===
+
+def run_benchmarks(names=None, repeat=DEFAULT_REPEAT, verbose=True):
+    """
+    Runs each benchmark repeat times. Returns {name: {"seconds": median time, "output": output}};
+    the median is used because single runs on shared machines are noisy in both directions.
+    Raises RuntimeError if a benchmark's output changes between repetitions.
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        func = BENCHMARKS[name]
+        times = []
+        output = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            result = json.loads(json.dumps(func()))  # Normalise to what the baseline stores
+            times.append(time.perf_counter() - start)
+            if i and result != output:
+                raise RuntimeError(f"{name}: output differs between repetitions")
+            output = result
+        results[name] = {"seconds": statistics.median(times), "output": output}
+        if verbose:
+            print(f"{name:32s} {results[name]['seconds'] * 1e3:10.2f} ms", flush=True)
+    return results
+
+
+def save_baseline(results, path=BASELINE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    baseline = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "benchmarks": results,
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, repeat=DEFAULT_REPEAT):
+    """
+    Compares results against a baseline's benchmarks. Returns the list of problems:
+    changed outputs and slowdowns beyond threshold (relative). A benchmark that looks
+    slower is measured again with twice the repetitions before it is reported.
+    """
+    problems = []
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            print(f"{name:32s} {current['seconds'] * 1e3:10.2f} ms  (no baseline)")
+            continue
+        ratio = current["seconds"] / reference["seconds"]
+        if ratio > 1 + threshold:
+            retry = run_benchmarks([name], 2 * repeat, verbose=False)[name]
+            current = {**current, "seconds": retry["seconds"]}
+            ratio = current["seconds"] / reference["seconds"]
+        status = ""
+        if current["output"] != reference["output"]:
+            status = "OUTPUT CHANGED"
+            problems.append(f"{name}: output {current['output']} != baseline {reference['output']}")
+        elif ratio > 1 + threshold:
+            status = "SLOWER"
+            problems.append(f"{name}: {ratio:.2f}x baseline time")
+        print(f"{name:32s} {reference['seconds'] * 1e3:10.2f} ms -> "
+              f"{current['seconds'] * 1e3:10.2f} ms  {ratio:5.2f}x  {status}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulator benchmarks and regression checks")
+    parser.add_argument("command", choices=["run", "compare"],
+                        help="run: measure (and optionally save a baseline); compare: check against one")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="with run: write the results as the baseline")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="repetitions per benchmark (the median time is kept)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="with compare: relative slowdown reported as a regression")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), metavar="NAME",
+                        help="run only these benchmarks")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run_benchmarks(args.only, args.repeat)
+        if args.save:
+            save_baseline(results, args.baseline)
+            print(f"Baseline saved to {args.baseline}")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["benchmarks"]
+        results = run_benchmarks(args.only, args.repeat, verbose=False)
+        problems = compare(results, baseline, args.threshold, args.repeat)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print("No regressions.")
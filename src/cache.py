@@ -0,0 +1,65 @@
+# cache.py - Content-addressed on-disk cache of simulation result rows
+
+import hashlib
+import json
+import os
+from dataclasses import asdict
+
+from config import DEFAULT_PARAMS
+from engine import ENGINE_VERSION
+
+CACHE_DIR = ".sim_cache"
+
+
+def run_key(W, L, seed, data_size, engine_options=None, tolerance=None, abstract=False):
+    """
+    Hash identifying one run's result: (W, L, seed), the run's SimParams (given as
+    engine_options["params"], default DEFAULT_PARAMS), the transferred data size, the
+    other engine options, steady-state tolerance, engine version and execution mode.
+    Payload-free runs have the same protocol statistics as full-payload runs, but
+    not the same checksums_avoided, so each mode has its own keys.
+    """
+    options = dict(engine_options or {})
+    params = options.pop("params", DEFAULT_PARAMS)
+    if not options.get("fec", True):
+        del options["fec"]  # The default: a --fec comparison's ARQ pass reuses ordinary runs
+    description = {
+        "W": W,
+        "L": L,
+        "seed": seed,
+        "data_size": data_size,
+        "parameters": asdict(params),
+        "engine_options": options,
+        "tolerance": tolerance,
+        "engine_version": ENGINE_VERSION,
+        "abstract": abstract,
+    }
+    encoded = json.dumps(description, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResultCache:
+    """One JSON file per run key, under directory/<key[:2]>/<key>.json."""
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        """Returns the cached result row for key, or None."""
+        try:
+            with open(self._path(key)) as f:
+                row = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return row
+
+    def put(self, key, row):
+        """Stores row atomically, so an interrupted sweep never leaves a partial entry."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(row, f)
+        os.replace(tmp_path, path)
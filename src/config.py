@@ -1,5 +1,7 @@
 # config.py
 
+from dataclasses import dataclass
+
 # Physical Layer Parameters
 BIT_RATE = 10 * 10**6  # 10 Mbps 
 FORWARD_PROP_DELAY = 0.040  # 40 ms 
@@ -20,4 +22,49 @@ RECEIVER_BUFFER_SIZE = 256 * 1024  # 256 KB
 # Experiment Parameters
 W_VALUES = [2, 4, 8, 16, 32, 64]
 L_VALUES = [128, 256, 512, 1024, 2048, 4096]
-TOTAL_DATA_SIZE = 100 * 1024 * 1024  # 100 MB 
\ No newline at end of file
+TOTAL_DATA_SIZE = 100 * 1024 * 1024  # 100 MB 
+
+@dataclass(frozen=True)
+class SimParams:
+    """
+    Physical, link and transport parameters of one simulation (defaults: the
+    constants above). Immutable and hashable, so engines with different channel
+    or buffer scenarios can run side by side in one process. The derived
+    per-frame-size constants below are plain arithmetic; the layers that need
+    them on the hot path memoize them per instance.
+    """
+    bit_rate: int = BIT_RATE
+    forward_prop_delay: float = FORWARD_PROP_DELAY
+    reverse_prop_delay: float = REVERSE_PROP_DELAY
+    processing_delay: float = PROCESSING_DELAY
+    p_g_to_b: float = P_G_TO_B
+    p_b_to_g: float = P_B_TO_G
+    ber_good: float = BER_GOOD
+    ber_bad: float = BER_BAD
+    transport_header_size: int = TRANSPORT_HEADER_SIZE
+    link_header_size: int = LINK_HEADER_SIZE
+    receiver_buffer_size: int = RECEIVER_BUFFER_SIZE
+
+    def frame_bytes(self, L):
+        """Size on the wire of a data frame carrying an L-byte payload."""
+        return self.link_header_size + self.transport_header_size + L
+
+    def tx_delay(self, frame_size_bytes):
+        """Transmission (serialization) delay of a frame."""
+        return (frame_size_bytes * 8) / self.bit_rate
+
+    def forward_delay(self, frame_size_bytes):
+        """Transmission + forward propagation + processing delay of a frame."""
+        return self.tx_delay(frame_size_bytes) + self.forward_prop_delay + self.processing_delay
+
+    def reverse_delay(self, frame_size_bytes):
+        """Transmission + reverse propagation + processing delay of a frame."""
+        return self.tx_delay(frame_size_bytes) + self.reverse_prop_delay + self.processing_delay
+
+    def success_probability(self, state, frame_size_bytes):
+        """P_success = (1 - BER)^N of a frame in the given channel state."""
+        ber = self.ber_good if state == "GOOD" else self.ber_bad
+        return (1 - ber) ** (frame_size_bytes * 8)
+
+
+DEFAULT_PARAMS = SimParams()
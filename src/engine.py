@@ -1,65 +1,206 @@
 # engine.py - Event-Driven Simulation Engine with Cross-Layer Integration
 
 import heapq
-from config import *
+import itertools
+import math
+from collections import deque
+from config import DEFAULT_PARAMS
+from stats import mean_ci
 
-class Event:
-    """Simulation event with proper ordering."""
-    _counter = 0
-    
-    def __init__(self, time, event_type, data=None):
-        self.time = time
-        self.type = event_type
-        self.data = data
-        Event._counter += 1
-        self._order = Event._counter
-    
-    def __lt__(self, other):
-        if self.time == other.time:
-            return self._order < other._order
-        return self.time < other.time
+# Bump whenever a change alters simulation results (invalidates cached runs)
+ENGINE_VERSION = 4
+
+APP_TICK = 0.001       # APP_CONSUME period in 'tick' drain mode
+TIMER_GUARD = 1e-9     # Wake just past a deadline so the strict timeout check fires
+
+ACK_COALESCE_DELAY = 0.005  # Default flush timer when several frames share one ACK
+
+# Steady-state mode: batch-means estimation of goodput over delivered segments
+BATCH_BYTES = 256 * 1024  # Delivered payload per batch
+MIN_BATCHES = 10          # Batches (after the discarded warm-up batch) before testing
+
+# Event kinds. Events are (time, order, kind, data) tuples, so the heap orders them
+# by native tuple comparison: time first, then the per-engine scheduling order.
+# data by kind: DATA_ARRIVE (seq, payload, corrupted, checksum, tx_time); ACK_ARRIVE
+# (seq, backpressure); DELAYED_ACK (seq, tx_time); APP_CONSUME and ACK_TIMER None;
+# LINK_FREE None, or the flush time of a partial FEC block; TIMEOUT the wake-up time;
+# SACK_ARRIVE (seq, echoed tx_time, cumulative ack, sack bitmap, backpressure);
+# PARITY_ARRIVE (first seq, lengths, checksums, parity, corrupted, tx_time); PARITY_ACK
+# (echoed tx_time, cumulative ack, sack bitmap, backpressure, frames missing, frames
+# covered). backpressure flags receiver buffer pressure since the previous ACK.
+(DATA_ARRIVE, ACK_ARRIVE, APP_CONSUME, DELAYED_ACK, LINK_FREE, TIMEOUT, SACK_ARRIVE, ACK_TIMER,
+ PARITY_ARRIVE, PARITY_ACK) = range(10)
+EVENT_NAMES = ('DATA_ARRIVE', 'ACK_ARRIVE', 'APP_CONSUME', 'DELAYED_ACK', 'LINK_FREE', 'TIMEOUT',
+               'SACK_ARRIVE', 'ACK_TIMER', 'PARITY_ARRIVE', 'PARITY_ACK')
 
 
 class SimulationEngine:
-    def __init__(self, W, L, seed):
+    def __init__(self, W, L, seed, app_drain="fluid", channel="scalar", instrument=False,
+                 params=DEFAULT_PARAMS, ack_mode=None, ack_every=1, ack_delay=None,
+                 window_control=None, link_adaptation=False, fec=False):
+        """
+        channel selects the Gilbert-Elliot implementation: "scalar" draws per frame from
+        random.Random(seed); "block" uses BlockPhysicalLayer's NumPy block draws; "trace"
+        replays seed's recorded state timeline, shared by every (W, L).
+        app_drain selects the receiving application and sender model:
+        - "fluid": continuous-rate reader evaluated lazily, and an event-driven sender:
+          frames go out exactly when the channel frees (LINK_FREE), an ACK opens the
+          window, the reader frees buffer space (APP_CONSUME) or a timer expires (TIMEOUT).
+        - "tick":  1 ms APP_CONSUME polling with the sender polled on every loop
+          iteration (the original model, kept for validation).
+        ack_mode selects the acknowledgement format:
+        - "sack":   (default in fluid mode) cumulative ACK (recv_base) plus a bitmap of the
+          frames buffered above it; the sender retransmits holes as soon as an ACK shows
+          them. ack_every > 1 coalesces up to that many in-order frames (at most W/2) into
+          one ACK, flushed after ack_delay seconds (default ACK_COALESCE_DELAY); ACKs for
+          out-of-order or gap-filling frames are always sent at once.
+        - "single": one ACK per frame for the frame's own seq, with 3-duplicate-ACK fast
+          retransmit (the original format; the only one tick mode supports).
+        window_control selects a dynamic send window ("aimd" or "bdp", see
+        layers.window_control); W is then the largest window it may open. None keeps
+        the window fixed at W.
+        link_adaptation=True (SACK mode only) cuts every new segment with a payload size
+        chosen from the channel estimate of a PayloadAdapter, with L as the largest size;
+        frame sizes, serialization delays and receiver buffer space then vary per frame.
+        fec=True (SACK mode only) adds XOR parity forward error correction below the
+        transport (layers.fec): one parity frame per block of new frames, with the block
+        size adapted to the loss rate the receiver reports; a single lost frame per block
+        is rebuilt at the receiver instead of being retransmitted.
+        params (SimParams) holds the physical/link/transport parameters of this run.
+        instrument=True attaches an EngineInstrumentation as self.profile (event counts,
+        handler times, timeout scans, heap high-water mark); otherwise profile is None.
+        """
         # Local imports to avoid circular dependency
-        from layers.physical import PhysicalLayer
-        from layers.transport import TransportLayer
+        from layers.physical import BlockPhysicalLayer, PhysicalLayer, TracePhysicalLayer
+        from layers.transport import PayloadAdapter, TransportLayer
         from layers.link import LinkLayer
+        from layers.window import RecvWindow
+        from layers.window_control import WINDOW_CONTROLLERS
+        from layers.fec import ParityDecoder, ParityEncoder
         
         self.W = W
         self.L = L
+        self.params = params
         
         # Initialize layers
-        self.phy = PhysicalLayer(seed=seed)
-        self.transport = TransportLayer(L)
-        self.link = LinkLayer(W, initial_timeout=0.150)
+        if channel == "scalar":
+            self.phy = PhysicalLayer(seed=seed, params=params)
+        elif channel == "block":
+            self.phy = BlockPhysicalLayer(seed=seed, params=params)
+        elif channel == "trace":
+            self.phy = TracePhysicalLayer(seed=seed, params=params)
+        else:
+            raise ValueError(f"Unknown channel: {channel}")
+        if app_drain not in ("fluid", "tick"):
+            raise ValueError(f"Unknown app_drain mode: {app_drain}")
+        self.fluid_drain = app_drain == "fluid"
+        if ack_mode is None:
+            ack_mode = "sack" if self.fluid_drain else "single"
+        if ack_mode not in ("sack", "single"):
+            raise ValueError(f"Unknown ack_mode: {ack_mode}")
+        if ack_mode == "sack" and not self.fluid_drain:
+            raise ValueError("SACK acknowledgements require the fluid (event-driven) model")
+        self.sack = ack_mode == "sack"
+        if link_adaptation and not self.sack:
+            raise ValueError("Link adaptation requires SACK acknowledgements (fluid model)")
+        self.adapter = PayloadAdapter(L, params) if link_adaptation else None
+        if fec and not self.sack:
+            raise ValueError("FEC requires SACK acknowledgements (fluid model)")
+        self.fec_encoder = ParityEncoder(params) if fec else None
+        self.fec_decoder = ParityDecoder() if fec else None
+        self.parity_pending = None  # Parity of a completed block, sent before anything else
+        self.ack_every = max(1, min(ack_every, W // 2))
+        self.ack_delay = ACK_COALESCE_DELAY if ack_delay is None else ack_delay
+        # One receive ring shared by both layers: the link's reorder window plus the
+        # transport's in-order segments, as many as the smallest segment fits in the buffer
+        smallest = L if self.adapter is None else self.adapter.sizes[0]
+        recv_window = RecvWindow(W, W + params.receiver_buffer_size // smallest + 1,
+                                 params.receiver_buffer_size, L if self.adapter is None else None)
+        self.transport = TransportLayer(L, drain_rate=params.bit_rate / 8 if self.fluid_drain else None,
+                                        params=params, receive_window=recv_window)
+        if window_control is None:
+            controller = None
+        elif window_control in WINDOW_CONTROLLERS:
+            controller = WINDOW_CONTROLLERS[window_control](W, params.frame_bytes(L), params.bit_rate)
+        else:
+            raise ValueError(f"Unknown window_control: {window_control}")
+        coalescing = self.sack and self.ack_every > 1
+        self.link = LinkLayer(W, initial_timeout=0.150,
+                              max_ack_delay=self.ack_delay if coalescing else 0.0,
+                              controller=controller, recv_buffer=recv_window)
         
         # Event queue
         self.events = []
         self.current_time = 0.0
+        self._event_order = itertools.count()
+        
+        # Dispatch table indexed by event kind
+        self.handlers = (self._handle_data_arrive, self._handle_ack_arrive,
+                         self._handle_app_consume, self._handle_delayed_ack,
+                         self._handle_link_free, self._handle_timeout,
+                         self._handle_sack_arrive, self._handle_ack_timer,
+                         self._handle_parity_arrive, self._handle_parity_ack)
         
         # Link serialization (Channel busy/free state)
         self.link_free_time = 0.0
         
         # App consumption rate (10 Mbps bit rate converted to Bytes/sec)
-        self.app_rate = BIT_RATE / 8
+        self.app_rate = params.bit_rate / 8
+        self.drain_wakeup = None  # Pending fluid-mode APP_CONSUME wake-up time
+        self.link_wakeup = None   # Pending fluid-mode LINK_FREE wake-up time
+        self.timer_wakeup = None  # Earliest pending fluid-mode TIMEOUT wake-up time
+        self.flush_wakeup = None  # Pending wake-up to close a partial FEC block
+        
+        # Fluid-mode retransmissions waiting for the channel (timeouts and fast retransmits)
+        self.retransmit_queue = deque()
+        self.retransmit_queued = set()
+        
+        # SACK-mode receiver: in-order frames not acknowledged yet (ACK coalescing)
+        self.unacked_arrivals = 0
+        self.last_arrival = None
+        self.ack_timer_pending = False
+        
+        # Receiver buffer pressure (delayed ACK, rejected or blocked segment) seen since
+        # the last ACK: the next ACK carries it to the sender's window controller
+        self.backpressure_pending = False
         
         # Statistics
         self.retransmissions = 0
         self.buffer_events = 0
         self.total_delivered = 0
         self.delayed_acks = 0
+        self.acks_sent = 0
+        self.parity_frames = 0
+        self.fec_recovered = 0  # Frames rebuilt from parity at the receiver
+        self.idle_advances = 0  # Times the clock was stepped forward with no event pending
         
         # RTT and Utilization tracking
-        self.rtt_samples = []
+        self.rtt_total = 0.0  # Sum and count of the RTT samples, for avg_rtt
+        self.rtt_count = 0
         self.total_tx_time = 0.0  # Total transmission time (channel busy)
+        
+        # Steady-state estimation (run(..., tolerance=...))
+        self.tolerance = None
+        self.batch_mark = math.inf  # recv_base that closes the current batch
+        self.batch_start = (0, 0.0) # (recv_base, time) at which the current batch opened
+        self.batch_times = []       # Seconds per delivered segment, one entry per batch
+        self.batch_bytes = 0        # Link adaptation: payload and segments of the measured batches
+        self.batch_delivered = 0
+        self.converged = False
+        self.goodput_estimate = None
+        self.goodput_ci = None      # 95% half-width of goodput_estimate (bps)
+        
+        # Opt-in profiling: wraps the handlers and hot methods above, so it comes last
+        self.profile = None
+        if instrument:
+            from instrumentation import EngineInstrumentation
+            self.profile = EngineInstrumentation(self)
     
     @property
     def avg_rtt(self):
         """Average RTT from non-retransmitted packets."""
-        if self.rtt_samples:
-            return sum(self.rtt_samples) / len(self.rtt_samples)
+        if self.rtt_count:
+            return self.rtt_total / self.rtt_count
         return 0.0
     
     @property
@@ -69,32 +210,112 @@ class SimulationEngine:
             return self.total_tx_time / self.current_time
         return 0.0
 
-    def schedule(self, delay, event_type, data=None):
+    @property
+    def checksums_avoided(self):
+        """CRC32 computations skipped thanks to the per-segment checksum cache."""
+        return self.transport.checksums_avoided
+
+    def schedule(self, delay, kind, data=None):
         """Schedules a new event in the priority queue."""
-        heapq.heappush(self.events, Event(self.current_time + delay, event_type, data))
+        heapq.heappush(self.events, (self.current_time + delay, next(self._event_order), kind, data))
     
-    def run(self, total_data):
-        """Main simulation loop: Runs until all segments are delivered to application."""
-        
-        segments = self.transport.segmentize(total_data)
-        total_segments = len(segments)
-        next_seg_idx = 0
+    def run(self, total_data, tolerance=None):
+        """
+        Main simulation loop: Runs until all segments are delivered to application.
+        total_data is either the bytes to transfer or, for a payload-free run, the
+        number of bytes; both give identical statistics for the same seed.
+        With a tolerance, the run stops early once the steady-state goodput estimate
+        (goodput_estimate +/- goodput_ci) has a relative 95% half-width below it.
+        """
+        self.start(total_data, tolerance=tolerance)
+        self.advance()
+        return self.current_time
+    
+    def start(self, total_data, tolerance=None):
+        """Prepares a run without processing any event; advance() then drives it."""
+        if self.adapter is not None:
+            # Segment sizes depend on this run's channel, so nothing can be shared
+            self.segments = self.transport.segmentize(total_data, variable=True)
+        else:
+            self.segments = self.transport.segmentize(total_data)
+        # With link adaptation the count is only known once the last segment is cut
+        if self.adapter is None:
+            self.total_segments = len(self.segments)
+        else:
+            self.total_segments = math.inf if self.segments.remaining else 0
+        self.next_seg_idx = 0
         
-        # Fixed sizes from config
-        frame_bytes = LINK_HEADER_SIZE + TRANSPORT_HEADER_SIZE + self.L
-        ack_bytes = LINK_HEADER_SIZE
+        # Fixed sizes from the parameters
+        self.frame_bytes = self.params.frame_bytes(self.L)
+        self.ack_bytes = self.params.link_header_size
+        if self.sack:
+            self.ack_bytes += (self.W + 7) // 8  # SACK bitmap
         
         # Serialization delays
-        tx_delay = (frame_bytes * 8) / BIT_RATE
+        self.tx_delay = self.params.tx_delay(self.frame_bytes)
+        
+        if tolerance is not None:
+            self.tolerance = tolerance
+            self.batch_segments = max(1, BATCH_BYTES // self.L)
+            self.batch_mark = self.batch_segments
+        
+        # Start application consumption loop, or the first transmission
+        if not self.fluid_drain:
+            self.schedule(APP_TICK, APP_CONSUME)
+        else:
+            self._pump()
+    
+    @property
+    def finished(self):
+        """True once every segment has been delivered (or the goodput estimate converged)."""
+        return self.converged or self.link.get_recv_base() >= self.total_segments
+    
+    def advance(self, until=math.inf):
+        """
+        Runs the simulation loop until the transfer completes or the clock reaches until.
+        Returns True when the transfer is complete.
+        """
+        if self.fluid_drain:
+            return self._advance_events(until)
+        return self._advance_polled(until)
+    
+    def _advance_events(self, until):
+        """Fluid mode: pure event loop; the handlers drive the sender."""
+        events = self.events
+        handlers = self.handlers
+        recv_window = self.link.recv_buffer
+        transport = self.transport
+        while recv_window.base < self.total_segments and self.current_time < until and not self.converged:
+            if not events:
+                # Unreachable while frames are outstanding (their timers are armed)
+                self.current_time += 0.001
+                self.idle_advances += 1
+                transport.drain(self.current_time)
+                self._pump()
+                continue
+            
+            event_time, _, kind, data = heapq.heappop(events)
+            self.current_time = event_time
+            transport.drain(event_time)
+            handlers[kind](data)
         
-        # Start application consumption loop
-        self.schedule(0.001, 'APP_CONSUME')
+        return self.finished
+    
+    def _advance_polled(self, until):
+        """Tick mode: the original loop, polling the sender and timers every iteration."""
+        segments = self.segments
+        total_segments = self.total_segments
+        next_seg_idx = self.next_seg_idx
+        frame_bytes = self.frame_bytes
+        tx_delay = self.tx_delay
         
-        while self.link.get_recv_base() < total_segments:
+        handlers = self.handlers
+        while (self.link.get_recv_base() < total_segments and self.current_time < until
+               and not self.converged):
             
             # 1. Backpressure Check: Combined buffer usage (Transport + Link Layer)
             # This ensures W=64, L=4096 will hit the 256KB limit during burst errors.
-            link_buffer_usage = len(self.link.recv_buffer) * self.L
+            link_buffer_usage = self.link.recv_buffer.bytes
             total_buffer_usage = self.transport.current_buffer_usage + link_buffer_usage
             buffer_available = (self.transport.buffer_capacity - total_buffer_usage) >= self.L
             
@@ -106,11 +327,11 @@ class SimulationEngine:
                 frame = self.link.create_frame(segment, tx_start)
                 if frame is not None:
                     forward_delay = self.phy.calculate_delay(frame_bytes, direction="forward")
-                    is_corrupted = self.phy.check_error(frame_bytes)
-                    checksum = self.transport.compute_checksum(segment.data)
+                    is_corrupted = self.phy.check_error(frame_bytes, tx_start)
+                    checksum = self.transport.segment_checksum(segment.seq_num, segment.data)
                     
-                    self.schedule(tx_start - self.current_time + forward_delay, 'DATA_ARRIVE',
-                        {'seq': frame.seq_num, 'payload': segment.data, 'corrupted': is_corrupted, 'checksum': checksum}
+                    self.schedule(tx_start - self.current_time + forward_delay, DATA_ARRIVE,
+                        (frame.seq_num, segment.data, is_corrupted, checksum, tx_start)
                     )
                     
                     self.link_free_time = tx_start + tx_delay
@@ -125,14 +346,14 @@ class SimulationEngine:
                 if frame:
                     tx_start = max(self.current_time, self.link_free_time)
                     forward_delay = self.phy.calculate_delay(frame_bytes, direction="forward")
-                    is_corrupted = self.phy.check_error(frame_bytes)
+                    is_corrupted = self.phy.check_error(frame_bytes, tx_start)
                     
                     # Ensure original checksum is included in retransmission
                     orig_payload = segments[seq].data
-                    orig_checksum = self.transport.compute_checksum(orig_payload)
+                    orig_checksum = self.transport.segment_checksum(seq, orig_payload)
                     
-                    self.schedule(tx_start - self.current_time + forward_delay, 'DATA_ARRIVE',
-                        {'seq': seq, 'payload': orig_payload, 'corrupted': is_corrupted, 'checksum': orig_checksum}
+                    self.schedule(tx_start - self.current_time + forward_delay, DATA_ARRIVE,
+                        (seq, orig_payload, is_corrupted, orig_checksum, tx_start)
                     )
                     self.link_free_time = tx_start + tx_delay
                     self.total_tx_time += tx_delay
@@ -140,68 +361,371 @@ class SimulationEngine:
             # 4. Event Processing
             if not self.events:
                 self.current_time += 0.001 # Move clock if idle
+                self.idle_advances += 1
                 continue
                 
-            event = heapq.heappop(self.events)
-            self.current_time = event.time
-            
-            if event.type == 'DATA_ARRIVE':
-                self._handle_data_arrive(event.data, ack_bytes)
-            
-            elif event.type == 'ACK_ARRIVE':
-                self._handle_ack_arrive(event.data['seq'], frame_bytes)
-            
-            elif event.type == 'APP_CONSUME':
-                # Consumes data based on a 1ms tick
-                self.transport.app_consume(int(self.app_rate * 0.001))
-                self.schedule(0.001, 'APP_CONSUME')
+            event_time, _, kind, data = heapq.heappop(self.events)
+            self.current_time = event_time
             
-            elif event.type == 'DELAYED_ACK':
-                self._send_ack(event.data['seq'], ack_bytes)
+            handlers[kind](data)
         
-        return self.current_time
+        self.next_seg_idx = next_seg_idx
+        return self.finished
+    
+    # === EVENT-DRIVEN SENDER (fluid mode) ===
     
-    def _handle_data_arrive(self, data, ack_bytes):
+    def _pump(self):
+        """
+        Transmits one frame if the channel is free - a queued retransmission first,
+        otherwise the next new segment if the window and receiver buffer allow - and
+        arranges the wake-up for whatever the sender is waiting on.
+        """
+        if self.link_free_time > self.current_time:
+            self._schedule_link_wakeup()
+            return
+        
+        if self.parity_pending is not None:
+            parity, self.parity_pending = self.parity_pending, None
+            self._transmit_parity(parity)
+            return
+        
+        queue = self.retransmit_queue
+        while queue:
+            seq = queue.popleft()
+            self.retransmit_queued.discard(seq)
+            if self.link.is_unacked(seq):
+                self.link.prepare_retransmit(seq, self.current_time)
+                self.retransmissions += 1
+                data = self.segments[seq].data
+                self._transmit(seq, data, self.transport.segment_checksum(seq, data))
+                return
+        
+        if self.next_seg_idx < self.total_segments and self.link.can_send():
+            # Backpressure: combined buffer usage (Transport + Link Layer), one shared ring
+            recv_window = self.link.recv_buffer
+            total_buffer_usage = recv_window.ready_bytes + recv_window.bytes
+            if self.adapter is None:
+                size = self.L
+            else:
+                size = min(self.adapter.next_size(self.link.window, self.link.estimated_rtt),
+                           self.segments.remaining)
+            if self.transport.buffer_capacity - total_buffer_usage >= size:
+                if self.adapter is None:
+                    segment = self.segments[self.next_seg_idx]
+                else:
+                    segment = self.transport.cut_segment(size)
+                    if not self.segments.remaining:
+                        self.total_segments = len(self.segments)
+                frame = self.link.create_frame(segment, self.current_time)
+                self.next_seg_idx += 1
+                checksum = self.transport.segment_checksum(segment.seq_num, segment.data)
+                self._transmit(frame.seq_num, segment.data, checksum)
+                if self.fec_encoder is not None and self.fec_encoder.add(
+                        frame.seq_num, segment.data, checksum, self.current_time,
+                        self.link.window, self.link.estimated_rtt):
+                    self.parity_pending = self.fec_encoder.take_parity()
+                return
+            # Blocked on receiver space: wake up when the reader frees a segment
+            self._schedule_drain_wakeup()
+        
+        if self.fec_encoder is not None and self.fec_encoder.open:
+            # Nothing else to send: close a partial block once it is old enough
+            flush_time = self.fec_encoder.flush_time(self.link.estimated_rtt)
+            if flush_time <= self.current_time or self.next_seg_idx >= self.total_segments:
+                self._transmit_parity(self.fec_encoder.take_parity())
+                return
+            if self.flush_wakeup is None:
+                self.flush_wakeup = flush_time
+                self.schedule(flush_time - self.current_time, LINK_FREE, flush_time)
+        
+        self._arm_timer()
+    
+    def _transmit(self, seq, data, checksum):
+        """Puts one frame on the (free) channel and wakes the sender when it frees again."""
+        if self.adapter is None:
+            frame_bytes, tx_delay = self.frame_bytes, self.tx_delay
+        else:
+            frame_bytes = self.params.frame_bytes(len(data))
+            tx_delay = self.params.tx_delay(frame_bytes)
+        forward_delay = self.phy.calculate_delay(frame_bytes, direction="forward")
+        is_corrupted = self.phy.check_error(frame_bytes, self.current_time)
+        self.schedule(forward_delay, DATA_ARRIVE, (seq, data, is_corrupted, checksum, self.current_time))
+        if self.adapter is not None:
+            self.adapter.sent(self.current_time, frame_bytes)
+        
+        self.link_free_time = self.current_time + tx_delay
+        self.total_tx_time += tx_delay
+        self._schedule_link_wakeup()
+        self._arm_timer()
+    
+    def _transmit_parity(self, parity):
+        """Puts the parity frame of a closed FEC block on the (free) channel."""
+        start, lengths, checksums, payload = parity
+        frame_bytes = self.fec_encoder.parity_frame_bytes(lengths)
+        tx_delay = self.params.tx_delay(frame_bytes)
+        forward_delay = self.phy.calculate_delay(frame_bytes, direction="forward")
+        is_corrupted = self.phy.check_error(frame_bytes, self.current_time)
+        self.schedule(forward_delay, PARITY_ARRIVE,
+                      (start, lengths, checksums, payload, is_corrupted, self.current_time))
+        self.fec_encoder.parity_sent(start, len(lengths), self.current_time)
+        if self.adapter is not None:
+            self.adapter.sent(self.current_time, frame_bytes)
+        self.parity_frames += 1
+        
+        self.link_free_time = self.current_time + tx_delay
+        self.total_tx_time += tx_delay
+        self._schedule_link_wakeup()
+        self._arm_timer()
+    
+    def _schedule_link_wakeup(self):
+        """Schedules one LINK_FREE wake-up for when the channel finishes its current frame."""
+        if self.link_wakeup is None:
+            self.link_wakeup = self.link_free_time
+            self.schedule(self.link_free_time - self.current_time, LINK_FREE)
+    
+    def _arm_timer(self):
+        """
+        Schedules a TIMEOUT wake-up just past the earliest retransmission deadline, unless
+        an earlier one is pending. While retransmissions are queued their (expired) timers
+        stay armed, so the next deadline is only armed once the queue has drained.
+        """
+        if self.retransmit_queue:
+            return
+        deadline = self.link.next_timeout()
+        if deadline is None:
+            return
+        wakeup = deadline + TIMER_GUARD
+        if self.timer_wakeup is None or wakeup < self.timer_wakeup:
+            self.timer_wakeup = wakeup
+            self.schedule(max(wakeup - self.current_time, 0.0), TIMEOUT, wakeup)
+    
+    def _queue_retransmit(self, seq, urgent=False):
+        """Queues seq for retransmission (urgent: ahead of the timeouts already queued)."""
+        if seq in self.retransmit_queued:
+            return
+        self.retransmit_queued.add(seq)
+        if urgent:
+            self.retransmit_queue.appendleft(seq)
+        else:
+            self.retransmit_queue.append(seq)
+    
+    def _handle_timeout(self, wakeup):
+        if wakeup == self.timer_wakeup:
+            self.timer_wakeup = None
+        for seq in self.link.get_timed_out_frames(self.current_time):
+            if self.adapter is not None:
+                self.adapter.lost(self.link.send_time(seq))
+            self._queue_retransmit(seq)
+        self._pump()
+    
+    def _schedule_drain_wakeup(self):
+        """Schedules one APP_CONSUME wake-up for when the fluid reader next frees space."""
+        release = self.transport.next_release_time()
+        if release is None or self.drain_wakeup is not None:
+            return
+        self.drain_wakeup = release
+        self.schedule(max(release - self.current_time, 0.0), APP_CONSUME)
+    
+    def _handle_app_consume(self, _):
+        if self.fluid_drain:
+            # The reader was already advanced to this instant; space may have freed up
+            self.drain_wakeup = None
+            self._pump()
+        else:
+            # Consumes data based on a 1ms tick
+            self.transport.app_consume(int(self.app_rate * APP_TICK))
+            self.schedule(APP_TICK, APP_CONSUME)
+    
+    def _handle_delayed_ack(self, data):
+        self._send_ack(*data)
+    
+    def _handle_link_free(self, flush_time):
+        if flush_time is None:
+            self.link_wakeup = None
+        else:
+            self.flush_wakeup = None
+        self._pump()
+    
+    def _handle_data_arrive(self, data):
         """Processes a data frame arriving at the receiver."""
-        if data['corrupted']:
+        seq, payload, corrupted, checksum, tx_time = data
+        if corrupted:
             return # Frame dropped due to BER
         
-        seq = data['seq']
-        payload = data['payload']
-        checksum = data['checksum']
+        if self.fec_decoder is not None:
+            # A retransmission may complete a block whose parity is waiting
+            for rebuilt in self.fec_decoder.receive(seq, payload, checksum, self.link.get_recv_base()):
+                self.fec_recovered += 1
+                self._accept_frame(*rebuilt)
         
-        # Step 1: Link Layer Processing
-        # NOTE: link.receive_frame must be updated to store (payload, checksum) tuples!
-        in_order_data, ack_seq = self.link.receive_frame(seq, payload, checksum)
-        
-        # Step 2: Delivery to Transport Layer with Integrity Check
-        for s_seq, s_payload, s_checksum in in_order_data:
-            success, _ = self.transport.receive_segment(s_seq, s_payload, s_checksum)
-            if not success:
-                self.buffer_events += 1 # Integrity fail or Buffer full
-                return 
+        # Steps 1-2: Link Layer Processing, then delivery to Transport Layer
+        in_order_data = self._accept_frame(seq, payload, checksum)
+        if in_order_data is None:
+            return
+        ack_seq = seq
 
         # Step 3: Send ACK
         if self.transport.should_delay_ack():
             self.delayed_acks += 1
-            self.schedule(0.010, 'DELAYED_ACK', {'seq': ack_seq}) # 10ms Backpressure
+            self.backpressure_pending = True
+            self.schedule(0.010, DELAYED_ACK, (ack_seq, tx_time)) # 10ms Backpressure
+        elif self.sack and self.ack_every > 1:
+            self._coalesce_ack(ack_seq, tx_time, len(in_order_data))
         else:
-            self._send_ack(ack_seq, ack_bytes)
+            self._send_ack(ack_seq, tx_time)
+    
+    def _accept_frame(self, seq, payload, checksum):
+        """
+        Hands a received frame to the link layer, and the segments it puts in order to
+        the transport layer (with integrity check). Returns the seqs put in order, or
+        None if the transport rejected a segment.
+        """
+        in_order, _ = self.link.receive_frame(seq, payload, checksum)
+        if in_order and not self.transport.receive_in_order(in_order):
+            self.buffer_events += 1 # Integrity fail
+            self.backpressure_pending = True
+            return None
+        if self.link.recv_buffer.blocked:
+            # Buffer full: in-order frames wait in the link window for the reader
+            self.buffer_events += 1
+            self.backpressure_pending = True
+        if self.link.get_recv_base() >= self.batch_mark:
+            self._close_batch()
+        return in_order
+    
+    def _handle_parity_arrive(self, data):
+        """Rebuilds the one missing frame of a block, and reports the block's losses."""
+        start, lengths, checksums, parity, corrupted, tx_time = data
+        if corrupted:
+            return
+        rebuilt, missing = self.fec_decoder.parity(start, lengths, checksums, parity,
+                                                   self.link.get_recv_base())
+        for frame in rebuilt:
+            self.fec_recovered += 1
+            self._accept_frame(*frame)
+        
+        # The loss report rides on an immediate SACK, which also shows the frames
+        # the parity could not rebuild
+        reverse_delay = self.phy.calculate_delay(self.ack_bytes, direction="reverse")
+        self.acks_sent += 1
+        self.unacked_arrivals = 0
+        cum_ack, sack_bits = self.link.sack()
+        backpressure, self.backpressure_pending = self.backpressure_pending, False
+        self.schedule(reverse_delay, PARITY_ACK,
+                      (tx_time, cum_ack, sack_bits, backpressure, missing, len(lengths)))
+    
+    def _coalesce_ack(self, seq, tx_time, delivered):
+        """SACK mode: holds the ACK for a plain in-order arrival until ack_every are pending."""
+        self.unacked_arrivals += 1
+        self.last_arrival = (seq, tx_time)
+        if (self.unacked_arrivals >= self.ack_every or delivered != 1
+                or self.link.recv_buffer.mask):
+            # Enough pending, or reordering: the sender needs the bitmap now
+            self._send_ack(seq, tx_time)
+        elif not self.ack_timer_pending:
+            self.ack_timer_pending = True
+            self.schedule(self.ack_delay, ACK_TIMER)
+    
+    def _handle_ack_timer(self, _):
+        self.ack_timer_pending = False
+        if self.unacked_arrivals:
+            self._send_ack(*self.last_arrival)
 
-    def _send_ack(self, seq, ack_bytes):
-        """Schedules the arrival of an ACK at the sender."""
-        reverse_delay = self.phy.calculate_delay(ack_bytes, direction="reverse")
-        self.schedule(reverse_delay, 'ACK_ARRIVE', {'seq': seq})
+    def _close_batch(self):
+        """
+        Records the batch that just completed and tests for convergence.
+        Batches end at the first delivery reaching batch_mark, so their sizes vary
+        slightly; each contributes its time per delivered segment. With link adaptation
+        segment sizes vary too, and the estimate uses their mean over the measured batches.
+        """
+        recv_base = self.link.get_recv_base()
+        start_base, start_time = self.batch_start
+        if start_base > 0:  # The first batch is warm-up and is discarded
+            self.batch_times.append((self.current_time - start_time) / (recv_base - start_base))
+            if self.adapter is not None:
+                self.batch_bytes += self.segments.offset(recv_base) - self.segments.offset(start_base)
+                self.batch_delivered += recv_base - start_base
+        self.batch_start = (recv_base, self.current_time)
+        self.batch_mark = recv_base + self.batch_segments
+        
+        if len(self.batch_times) < MIN_BATCHES:
+            return
+        mean_time, half_width = mean_ci(self.batch_times)
+        segment_bytes = self.L if self.adapter is None else self.batch_bytes / self.batch_delivered
+        self.goodput_estimate = segment_bytes * 8 / mean_time
+        # Delta method: relative error of 1/x equals that of x
+        self.goodput_ci = self.goodput_estimate * half_width / mean_time
+        if half_width / mean_time < self.tolerance:
+            self.converged = True
+
+    def _send_ack(self, seq, tx_time):
+        """
+        Schedules the arrival of an ACK for the frame seq transmitted at tx_time; in SACK
+        mode a SACK of the current receiver state that echoes tx_time (like a TCP timestamp).
+        """
+        reverse_delay = self.phy.calculate_delay(self.ack_bytes, direction="reverse")
+        self.acks_sent += 1
+        backpressure, self.backpressure_pending = self.backpressure_pending, False
+        if self.sack:
+            self.unacked_arrivals = 0
+            cum_ack, sack_bits = self.link.sack()
+            self.schedule(reverse_delay, SACK_ARRIVE, (seq, tx_time, cum_ack, sack_bits, backpressure))
+        else:
+            self.schedule(reverse_delay, ACK_ARRIVE, (seq, backpressure))
+    
+    def _handle_sack_arrive(self, data):
+        """Applies a selective ACK and queues every frame it reveals as lost."""
+        seq, tx_time, cum_ack, sack_bits, backpressure = data
+        rtt_sample = self.link.rtt_sample(seq, self.current_time)
+        if rtt_sample is not None:
+            self.rtt_total += rtt_sample
+            self.rtt_count += 1
+        if backpressure:
+            self.link.signal_backpressure(self.current_time)
+        
+        if self.adapter is not None:
+            self.adapter.delivered(tx_time)
+        lost_frames = self.link.process_sack(seq, tx_time, cum_ack, sack_bits, self.current_time)
+        if self.fec_encoder is not None:
+            # Holes whose parity is still on its way may yet be rebuilt
+            self.fec_encoder.forget(self.link.send_base)
+            deferred = [lost for lost in lost_frames if self.fec_encoder.deferred(lost, tx_time)]
+            if deferred:
+                self.link.keep_loss_candidates(deferred)
+                lost_frames = [lost for lost in lost_frames if lost not in deferred]
+        for lost in lost_frames:
+            if self.adapter is not None:
+                self.adapter.lost(self.link.send_time(lost))
+            self._queue_retransmit(lost)
+        self._pump()
 
-    def _handle_ack_arrive(self, seq, frame_bytes):
+    def _handle_parity_ack(self, data):
+        """Feeds the receiver's loss report to the FEC encoder, then applies the SACK."""
+        tx_time, cum_ack, sack_bits, backpressure, missing, covered = data
+        self.fec_encoder.report(missing, covered)
+        self._handle_sack_arrive((None, tx_time, cum_ack, sack_bits, backpressure))
+    
+    def _handle_ack_arrive(self, data):
         """Process the ACK in the Link Layer with Fast Retransmit support."""
+        seq, backpressure = data
         # Get RTT sample before processing ACK (if available and not retransmitted)
-        if seq in self.link.send_window and not self.link.send_window[seq]['retransmitted']:
-            rtt_sample = self.current_time - self.link.send_window[seq]['send_time']
-            self.rtt_samples.append(rtt_sample)
+        rtt_sample = self.link.rtt_sample(seq, self.current_time)
+        if rtt_sample is not None:
+            self.rtt_total += rtt_sample
+            self.rtt_count += 1
+        if backpressure:
+            self.link.signal_backpressure(self.current_time)
         
         trigger_fast_retransmit = self.link.process_ack(seq, self.current_time)
         
+        if self.fluid_drain:
+            # Fast retransmit goes to the head of the queue; the ACK may also have opened the window
+            if trigger_fast_retransmit:
+                self._queue_retransmit(self.link.send_base, urgent=True)
+                self.link.dup_ack_count = 0
+            self._pump()
+            return
+        
         # If 3 duplicate ACKs occur, retransmit the oldest unacked packet immediately
         if trigger_fast_retransmit:
             base_seq = self.link.send_base
@@ -210,15 +734,15 @@ class SimulationEngine:
                 self.retransmissions += 1
                 # Schedule immediate retransmission
                 tx_start = max(self.current_time, self.link_free_time)
-                forward_delay = self.phy.calculate_delay(frame_bytes, direction="forward")
-                is_corrupted = self.phy.check_error(frame_bytes)
+                forward_delay = self.phy.calculate_delay(self.frame_bytes, direction="forward")
+                is_corrupted = self.phy.check_error(self.frame_bytes, tx_start)
                 
                 # Get original payload and checksum
-                orig_payload = frame.payload[8:]  # Skip transport header
-                orig_checksum = self.transport.compute_checksum(orig_payload)
+                orig_payload = frame.payload.data
+                orig_checksum = self.transport.segment_checksum(base_seq, orig_payload)
                 
-                self.schedule(tx_start - self.current_time + forward_delay, 'DATA_ARRIVE',
-                    {'seq': base_seq, 'payload': orig_payload, 'corrupted': is_corrupted, 'checksum': orig_checksum}
+                self.schedule(tx_start - self.current_time + forward_delay, DATA_ARRIVE,
+                    (base_seq, orig_payload, is_corrupted, orig_checksum, tx_start)
                 )
                 
                 # Reset dup_ack_count to avoid repeated fast retransmits for same packet
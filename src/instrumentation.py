@@ -0,0 +1,96 @@
+# instrumentation.py - Opt-in hot-path counters and timers for SimulationEngine
+
+import time
+
+from engine import EVENT_NAMES
+
+
+class EngineInstrumentation:
+    """
+    Profiles one SimulationEngine by wrapping its hot paths in place:
+    - the dispatch table: events and wall-clock seconds per event kind;
+    - schedule(): event heap high-water mark;
+    - link.get_timed_out_frames(): timeout scans, frames they expired and their cost;
+    - advance(): wall-clock seconds in the event loop (for events per second).
+    An engine built without instrument=True keeps its plain methods, so the only
+    cost left when disabled is the idle-advance counter on the rarely taken idle branch.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.events = [0] * len(EVENT_NAMES)
+        self.handler_time = [0.0] * len(EVENT_NAMES)
+        self.heap_high_water = 0
+        self.timeout_scans = 0
+        self.timeouts_found = 0
+        self.timeout_scan_time = 0.0
+        self.loop_time = 0.0
+
+        engine.handlers = tuple(self._timed_handler(kind, handler)
+                                for kind, handler in enumerate(engine.handlers))
+        engine.schedule = self._tracked_schedule(engine.schedule)
+        engine.link.get_timed_out_frames = self._timed_scan(engine.link.get_timed_out_frames)
+        engine.advance = self._timed_advance(engine.advance)
+
+    def _timed_handler(self, kind, handler):
+        events, handler_time = self.events, self.handler_time
+        clock = time.perf_counter
+        def timed(data):
+            start = clock()
+            handler(data)
+            handler_time[kind] += clock() - start
+            events[kind] += 1
+        return timed
+
+    def _tracked_schedule(self, schedule):
+        queue = self.engine.events
+        def tracked(delay, kind, data=None):
+            schedule(delay, kind, data)
+            if len(queue) > self.heap_high_water:
+                self.heap_high_water = len(queue)
+        return tracked
+
+    def _timed_scan(self, scan):
+        clock = time.perf_counter
+        def timed(current_time):
+            start = clock()
+            expired = scan(current_time)
+            self.timeout_scan_time += clock() - start
+            self.timeout_scans += 1
+            self.timeouts_found += len(expired)
+            return expired
+        return timed
+
+    def _timed_advance(self, advance):
+        clock = time.perf_counter
+        def timed(until=float("inf")):
+            start = clock()
+            try:
+                return advance(until)
+            finally:
+                self.loop_time += clock() - start
+        return timed
+
+    @property
+    def events_processed(self):
+        return sum(self.events)
+
+    @property
+    def events_per_sec(self):
+        return self.events_processed / self.loop_time if self.loop_time > 0 else 0.0
+
+    def stats(self):
+        """Flat {name: value} dict, merged into the results row."""
+        stats = {}
+        for name, count, seconds in zip(EVENT_NAMES, self.events, self.handler_time):
+            stats[f"events_{name.lower()}"] = count
+            stats[f"time_{name.lower()}"] = seconds
+        stats.update({
+            "idle_advances": self.engine.idle_advances,
+            "timeout_scans": self.timeout_scans,
+            "timeouts_found": self.timeouts_found,
+            "timeout_scan_time": self.timeout_scan_time,
+            "heap_high_water": self.heap_high_water,
+            "loop_time": self.loop_time,
+            "events_per_sec": self.events_per_sec,
+        })
+        return stats
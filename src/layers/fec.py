@@ -0,0 +1,177 @@
+# fec.py - XOR parity forward error correction between TransportLayer and LinkLayer
+
+import math
+
+import numpy as np
+from models import AbstractPayload
+
+BLOCK_SIZES = (2, 4, 8, 16, 32, 64)  # Candidate data frames per parity frame
+PARITY_ENTRY_BYTES = 6  # Parity header per covered frame: 2-byte length + 4-byte CRC32
+
+
+def xor_payloads(payloads, length):
+    """XOR of payloads zero-padded to length bytes; an AbstractPayload for payload-free runs."""
+    if isinstance(payloads[0], AbstractPayload):
+        return AbstractPayload(length)
+    parity = np.zeros(length, dtype=np.uint8)
+    for payload in payloads:
+        data = np.frombuffer(payload, dtype=np.uint8)
+        parity[:len(data)] ^= data
+    return parity
+
+
+class ParityEncoder:
+    """
+    Sender side. First transmissions are grouped into blocks of block_size consecutive
+    frames; each block is followed by one parity frame carrying the XOR of its payloads
+    plus every frame's length and checksum, from which the receiver rebuilds any single
+    lost frame. A partial block is closed once it has been open for a quarter of an
+    RTT (flush_rtt) without the sender having anything else to send.
+    While a frame's parity is still on its way, SACK holes for it are not treated as
+    losses (deferred), so FEC gets the chance to repair them first.
+    block_size adapts to the raw frame loss rate q the receiver reports: assuming
+    independent losses, a block leaves r = q(1 - (1 - q)^k) of its data unrepaired,
+    and k is picked to maximise min(link-limited rate k/(k+1) (1 - r), window-limited
+    rate 1 / rounds(r)), with the Selective Repeat window turnover of PayloadAdapter.
+    """
+    gain = 1 / 16     # EWMA weight of one reported frame
+    flush_rtt = 0.25  # Age, in RTTs, at which an idle sender closes a partial block
+
+    def __init__(self, params, block_sizes=BLOCK_SIZES):
+        self.params = params
+        self.block_sizes = block_sizes
+        self.block_size = block_sizes[-1]
+        self.loss_rate = 0.0
+        self.open = []          # (seq, payload, checksum) of the block being filled
+        self.opened = None      # Send time of the open block's first frame
+        self.parity_times = {}  # seq -> send time of the parity covering it
+
+    def add(self, seq, payload, checksum, current_time, window, rtt):
+        """Adds a first transmission; returns True once its block is complete."""
+        if not self.open:
+            self.opened = current_time
+            self.block_size = self._choose_block_size(window, rtt, len(payload))
+        self.open.append((seq, payload, checksum))
+        return len(self.open) >= self.block_size
+
+    def flush_time(self, rtt):
+        """When an idle sender should close the open (partial) block."""
+        return self.opened + self.flush_rtt * rtt
+
+    def take_parity(self):
+        """Closes the open block: (start seq, lengths, checksums, parity payload)."""
+        block, self.open = self.open, []
+        lengths = tuple(len(payload) for _, payload, _ in block)
+        checksums = tuple(checksum for _, _, checksum in block)
+        return block[0][0], lengths, checksums, xor_payloads([p for _, p, _ in block], max(lengths))
+
+    def parity_frame_bytes(self, lengths):
+        return self.params.frame_bytes(max(lengths)) + PARITY_ENTRY_BYTES * len(lengths)
+
+    def parity_sent(self, start, count, tx_time):
+        for seq in range(start, start + count):
+            self.parity_times[seq] = tx_time
+
+    def deferred(self, seq, tx_time):
+        """True while seq's parity has not reached the receiver before transmission tx_time."""
+        if self.open and seq >= self.open[0][0]:
+            return True
+        return self.parity_times.get(seq, -math.inf) > tx_time
+
+    def forget(self, send_base):
+        """Drops the parity times of frames below the send window."""
+        parity_times = self.parity_times
+        while parity_times:
+            seq = next(iter(parity_times))
+            if seq >= send_base:
+                break
+            del parity_times[seq]
+
+    def report(self, lost, covered):
+        """Receiver loss report: lost of the covered frames of one block were missing."""
+        keep = (1 - self.gain) ** covered
+        self.loss_rate = keep * self.loss_rate + (1 - keep) * lost / covered
+
+    def _choose_block_size(self, window, rtt, payload_bytes):
+        q = min(self.loss_rate, 0.999)
+        frame_bytes = self.params.frame_bytes(payload_bytes)
+        best, best_rate = self.block_sizes[0], -1.0
+        for k in reversed(self.block_sizes):  # Ties go to the least parity
+            if k > window:
+                continue
+            residual = q * (1 - (1 - q) ** k)
+            rounds = 1 + math.log(window) / -math.log(residual) if residual > 0 else 1
+            rate = min(self.params.bit_rate * payload_bytes / frame_bytes * k / (k + 1) * (1 - residual),
+                       window * 8 * payload_bytes / (rtt * rounds))
+            if rate > best_rate:
+                best, best_rate = k, rate
+        return best
+
+
+class ParityDecoder:
+    """
+    Receiver side. Keeps every frame that arrived within the last max_block sequence
+    numbers below recv_base (a block never spans more) and every parity whose block
+    still misses two or more frames; as soon as a block misses exactly one frame, that
+    frame is rebuilt from the parity and the block's other frames.
+    """
+    def __init__(self, max_block=BLOCK_SIZES[-1]):
+        self.max_block = max_block
+        self.frames = {}   # seq -> (payload, checksum)
+        self.pending = {}  # start seq -> (lengths, checksums, parity) of unrepaired blocks
+        self.oldest = 0    # Frames below this have been dropped
+
+    def receive(self, seq, payload, checksum, recv_base):
+        """Records an arriving data frame; returns the frames it lets a pending parity rebuild."""
+        self._prune(recv_base)
+        if seq < self.oldest or seq in self.frames:
+            return []
+        self.frames[seq] = (payload, checksum)
+        for start, (lengths, _, _) in self.pending.items():
+            if start <= seq < start + len(lengths):
+                return self._repair(start, recv_base)
+        return []
+
+    def parity(self, start, lengths, checksums, parity, recv_base):
+        """
+        Records an arriving parity frame. Returns (rebuilt frames, frames of its block
+        that were missing on arrival) - the latter is the loss report for the sender.
+        """
+        self._prune(recv_base)
+        missing = sum(1 for seq in range(start, start + len(lengths))
+                      if seq >= recv_base and seq not in self.frames)
+        if missing:
+            self.pending[start] = (lengths, checksums, parity)
+            return self._repair(start, recv_base), missing
+        return [], 0
+
+    def _repair(self, start, recv_base):
+        lengths, checksums, parity = self.pending[start]
+        missing = [seq for seq in range(start, start + len(lengths))
+                   if seq >= recv_base and seq not in self.frames]
+        if len(missing) > 1:
+            return []
+        del self.pending[start]
+        if not missing:
+            return []
+        seq = missing[0]
+        length, checksum = lengths[seq - start], checksums[seq - start]
+        if isinstance(parity, AbstractPayload):
+            payload = AbstractPayload(length)
+        else:
+            others = [self.frames[s][0] for s in range(start, start + len(lengths)) if s != seq]
+            payload = xor_payloads([parity] + others, len(parity))[:length].tobytes()
+        self.frames[seq] = (payload, checksum)
+        return [(seq, payload, checksum)]
+
+    def _prune(self, recv_base):
+        oldest = recv_base - self.max_block
+        if oldest <= self.oldest:
+            return
+        frames = self.frames
+        for seq in range(self.oldest, oldest):
+            frames.pop(seq, None)
+        self.oldest = oldest
+        for start in [start for start, (lengths, _, _) in self.pending.items()
+                      if start + len(lengths) <= recv_base]:
+            del self.pending[start]
@@ -1,17 +1,24 @@
 # link.py - Link Layer with Selective Repeat ARQ + Adaptive Timeout
 
-from config import LINK_HEADER_SIZE
 from models import Frame
+from layers.window import RecvWindow, SendWindow
+from collections import deque
+import heapq
 import math
 
 class LinkLayer:
-    def __init__(self, window_size, initial_timeout=0.150):
+    def __init__(self, window_size, initial_timeout=0.150, max_ack_delay=0.0, controller=None,
+                 recv_buffer=None):
         self.W = window_size
         
         # === SENDER STATE ===
-        self.send_base = 0
-        self.next_seq_num = 0
-        self.send_window = {}  # {seq: {'frame': Frame, 'send_time': float, 'acked': bool, 'retransmitted': bool}}
+        self.send_window = SendWindow(window_size)  # frame, send_time, acked, retransmitted per seq
+        
+        # === RETRANSMISSION TIMERS ===
+        # Min-heap of (send_time, seq). All frames share one timeout_interval, so the
+        # earliest send_time is always the earliest deadline. ACKs and re-arms are
+        # applied lazily: an entry is stale once its frame is acked or resent.
+        self.timers = []
         
         # === ADAPTIVE TIMEOUT (Jacobson's Algorithm) ===
         self.estimated_rtt = initial_timeout
@@ -19,43 +26,89 @@ class LinkLayer:
         self.timeout_interval = initial_timeout
         self.alpha = 0.125
         self.beta = 0.25
+        # Longest the receiver may hold an ACK (coalescing); added to every timeout
+        self.max_ack_delay = max_ack_delay
+        
+        # === SEND WINDOW CONTROL ===
+        # W is the ring capacity; an optional WindowController moves the effective
+        # window between 1 and W as ACKs, losses and receiver backpressure come in.
+        self.controller = controller
+        self.window = window_size
+        if controller is not None:
+            controller.start(self)
+            self.window = controller.window
         
         # === FAST RETRANSMIT STATE ===
         self.last_ack_received = -1
         self.dup_ack_count = 0
         
+        # === SELECTIVE ACK STATE ===
+        # Frames every SACK so far has covered: below sack_cum, plus bit i of sack_seen for
+        # frame sack_cum + i. Only bits a SACK sets for the first time are applied.
+        self.sack_cum = 0
+        self.sack_seen = 0
+        # (send_time, seq) of every transmission in send order: the loss candidates. An
+        # entry is stale once its frame is acked or resent; each is looked at once.
+        self.transmissions = deque()
+        
         # === RECEIVER STATE ===
-        self.recv_base = 0
-        self.recv_buffer = {}  # {seq: (payload, checksum)} for out-of-order
+        # (payload, checksum) for out-of-order frames; recv_buffer shares the ring with
+        # the TransportLayer, which reads the in-order frames from it
+        self.recv_buffer = RecvWindow(window_size) if recv_buffer is None else recv_buffer
         self.pending_acks = []
+    
+    @property
+    def send_base(self):
+        return self.send_window.base
+    
+    @property
+    def next_seq_num(self):
+        return self.send_window.next_seq
+    
+    @property
+    def recv_base(self):
+        return self.recv_buffer.base
         
     # === SENDER FUNCTIONS ===
     
     def can_send(self):
         """Check if sender window has space."""
-        return self.next_seq_num < self.send_base + self.W
+        return self.send_window.next_seq < self.send_window.base + self.window
     
     def get_unacked_count(self):
         """Return number of unacknowledged frames."""
-        return sum(1 for info in self.send_window.values() if not info['acked'])
+        return self.send_window.unacked
     
     def create_frame(self, segment, current_time):
         """Create and register a new frame for transmission."""
         if not self.can_send():
             return None
         
-        frame = Frame(self.next_seq_num, "DATA", segment.pack())
+        # The frame references the segment; headers are only packed on the wire
+        frame = Frame(self.send_window.next_seq, "DATA", segment)
+        seq = self.send_window.add(frame, current_time)
+        heapq.heappush(self.timers, (current_time, seq))
         
-        self.send_window[self.next_seq_num] = {
-            'frame': frame,
-            'send_time': current_time,
-            'acked': False,
-            'retransmitted': False
-        }
-        
-        self.next_seq_num += 1
+        transmissions = self.transmissions
+        transmissions.append((current_time, seq))
+        if len(transmissions) > 2 * self.W:
+            # Without SACKs nothing else drops stale loss candidates: trim the head
+            while not self._timer_is_live(*transmissions[0]):
+                transmissions.popleft()
         return frame
     
+    def rtt_sample(self, seq, current_time):
+        """RTT of the frame an ACK for seq refers to, or None if unknown or retransmitted (Karn)."""
+        sw = self.send_window
+        if seq is not None and seq in sw and not sw.retransmitted[seq % sw.capacity]:
+            return current_time - sw.send_times[seq % sw.capacity]
+        return None
+    
+    def send_time(self, seq):
+        """Time seq (in the send window) was last transmitted."""
+        sw = self.send_window
+        return sw.send_times[seq % sw.capacity]
+    
     def process_ack(self, ack_seq, current_time=None):
         """
         Processes an ACK and updates RTT/Timeout logic.
@@ -69,47 +122,151 @@ class LinkLayer:
             self.dup_ack_count = 0
 
         # 2. Update Window State
-        if ack_seq in self.send_window:
+        sw = self.send_window
+        if sw.base <= ack_seq < sw.next_seq:
             # Only update RTT for packets that were NOT retransmitted (Karn's Algorithm)
-            if current_time is not None and not self.send_window[ack_seq]['retransmitted']:
-                sample_rtt = current_time - self.send_window[ack_seq]['send_time']
+            i = ack_seq % sw.capacity
+            if current_time is not None and not sw.retransmitted[i]:
+                sample_rtt = current_time - sw.send_times[i]
                 self._update_rto(sample_rtt)
             
-            self.send_window[ack_seq]['acked'] = True
-            
-            # Slide window
-            while self.send_base in self.send_window and self.send_window[self.send_base]['acked']:
-                del self.send_window[self.send_base]
-                self.send_base += 1
+            # Mark acked and slide window
+            unacked = sw.unacked
+            sw.mark_acked(ack_seq)
+            if self.controller is not None and sw.unacked < unacked:
+                self._on_acked(1, current_time)
                 
         # Return True if Fast Retransmit is triggered (3 duplicate ACKs)
         return self.dup_ack_count >= 3
 
+    def process_sack(self, seq, tx_time, cum_ack, sack_bits, current_time=None):
+        """
+        Processes a selective ACK triggered by the transmission of frame seq at tx_time:
+        every frame below cum_ack and every frame cum_ack + i with bit i of sack_bits
+        set has been received. Returns the frames now known to be lost (ascending):
+        unacked frames last sent before tx_time. The forward channel is FIFO, so anything
+        sent earlier has either arrived (and is acked here) or was dropped. seq is None
+        for a SACK triggered by an FEC parity frame, which covers every frame sent before it.
+        Each frame and each transmission is visited once over all SACKs, so a SACK costs
+        O(newly acked + newly lost) however long a hole pins the window.
+        """
+        sw = self.send_window
+        capacity, send_times = sw.capacity, sw.send_times
+        
+        in_window = seq is None or sw.base <= seq < sw.next_seq
+        if seq is not None and in_window:
+            i = seq % capacity
+            if current_time is not None and not sw.retransmitted[i]:
+                self._update_rto(current_time - send_times[i])
+        
+        unacked = sw.unacked
+        for s in range(sw.base, min(cum_ack, sw.next_seq)):
+            sw.mark_acked(s)
+        shift = cum_ack - self.sack_cum
+        seen = self.sack_seen >> shift if shift >= 0 else self.sack_seen << -shift
+        self.sack_cum, self.sack_seen = cum_ack, sack_bits | seen
+        new_bits = sack_bits & ~seen
+        while new_bits:
+            low = new_bits & -new_bits
+            s = cum_ack + low.bit_length() - 1
+            if sw.base <= s < sw.next_seq:
+                sw.mark_acked(s)
+            new_bits ^= low
+        if self.controller is not None and sw.unacked < unacked:
+            self._on_acked(unacked - sw.unacked, current_time)
+        
+        if not in_window:
+            return []
+        lost = []
+        transmissions = self.transmissions
+        while transmissions and transmissions[0][0] < tx_time:
+            send_time, s = transmissions.popleft()
+            if self._timer_is_live(send_time, s):
+                lost.append(s)
+        lost.sort()
+        return lost
+    
+    def keep_loss_candidates(self, seqs):
+        """
+        Puts frames process_sack just reported lost back into loss detection, for a
+        caller that defers them: the next SACK reports them again.
+        """
+        sw = self.send_window
+        entries = sorted((sw.send_times[s % sw.capacity], s) for s in seqs)
+        self.transmissions.extendleft(reversed(entries))
+    
     def _update_rto(self, sample_rtt):
         """Jacobson's Algorithm for RTO calculation."""
         self.estimated_rtt = (1 - self.alpha) * self.estimated_rtt + self.alpha * sample_rtt
         self.dev_rtt = (1 - self.beta) * self.dev_rtt + self.beta * abs(sample_rtt - self.estimated_rtt)
-        self.timeout_interval = self.estimated_rtt + 4 * self.dev_rtt
+        self.timeout_interval = self.estimated_rtt + 4 * self.dev_rtt + self.max_ack_delay
         # Safety bound: cap timeout between 20ms and 500ms
         self.timeout_interval = max(0.020, min(self.timeout_interval, 0.500))
 
+    def _timer_is_live(self, send_time, seq):
+        """A heap entry is live while its frame is unacked and has not been resent since."""
+        sw = self.send_window
+        i = seq % sw.capacity
+        return sw.base <= seq < sw.next_seq and not sw.acked[i] and sw.send_times[i] == send_time
+    
+    def next_timeout(self):
+        """Return the earliest retransmission deadline, or None if no timer is armed."""
+        timers = self.timers
+        while timers:
+            send_time, seq = timers[0]
+            if self._timer_is_live(send_time, seq):
+                return send_time + self.timeout_interval
+            heapq.heappop(timers)
+        return None
+    
     def get_timed_out_frames(self, current_time):
-        """Return list of seq numbers that have timed out."""
-        timed_out = []
-        for seq, info in self.send_window.items():
-            if not info['acked']:
-                if current_time - info['send_time'] > self.timeout_interval:
-                    timed_out.append(seq)
-        return timed_out
+        """Return list of seq numbers that have timed out (ascending)."""
+        timers = self.timers
+        expired = []
+        while timers:
+            send_time, seq = timers[0]
+            if not self._timer_is_live(send_time, seq):
+                heapq.heappop(timers)
+            elif current_time - send_time > self.timeout_interval:
+                expired.append(heapq.heappop(timers))
+            else:
+                break
+        
+        # Expired timers stay armed until prepare_retransmit re-arms them
+        for entry in expired:
+            heapq.heappush(timers, entry)
+        return sorted({seq for _, seq in expired})
     
     def prepare_retransmit(self, seq, current_time):
         """Marks frame as retransmitted and resets timer."""
-        if seq in self.send_window:
-            self.send_window[seq]['send_time'] = current_time
-            self.send_window[seq]['retransmitted'] = True
-            return self.send_window[seq]['frame']
+        sw = self.send_window
+        if seq in sw:
+            i = seq % sw.capacity
+            if self.controller is not None:
+                self.controller.on_loss(sw.send_times[i], current_time, self)
+                self.window = self.controller.window
+            sw.send_times[i] = current_time
+            sw.retransmitted[i] = 1
+            heapq.heappush(self.timers, (current_time, seq))
+            self.transmissions.append((current_time, seq))
+            return sw.frames[i]
         return None
     
+    def _on_acked(self, newly_acked, current_time):
+        self.controller.on_ack(newly_acked, current_time, self)
+        self.window = self.controller.window
+    
+    def signal_backpressure(self, current_time):
+        """Receiver buffer pressure reported by an ACK (delayed ACK, rejected or blocked segment)."""
+        if self.controller is not None:
+            self.controller.on_backpressure(current_time, self)
+            self.window = self.controller.window
+    
+    def is_unacked(self, seq):
+        """True while seq is in the send window and not yet acknowledged."""
+        sw = self.send_window
+        return sw.base <= seq < sw.next_seq and not sw.acked[seq % sw.capacity]
+    
     def all_acked(self):
         """Check if all sent frames are acknowledged."""
         return len(self.send_window) == 0
@@ -119,21 +276,21 @@ class LinkLayer:
     def receive_frame(self, seq, payload, checksum):
         """
         Process received data frame (Selective Repeat).
-        Returns: (in_order_data, ack_seq)
-        - in_order_data: list of (seq, payload, checksum) ready for transport layer
+        Returns: (in_order, ack_seq)
+        - in_order: range of the seqs this frame put in order, now handed to the
+          transport layer in the shared receive buffer
         - ack_seq: sequence number to ACK
         """
-        in_order = []
-        if self.recv_base <= seq < self.recv_base + self.W:
-            if seq not in self.recv_buffer:
-                self.recv_buffer[seq] = (payload, checksum)
-            
-            while self.recv_base in self.recv_buffer:
-                p, c = self.recv_buffer[self.recv_base]
-                in_order.append((self.recv_base, p, c))
-                del self.recv_buffer[self.recv_base]
-                self.recv_base += 1
-        return in_order, seq
+        rb = self.recv_buffer
+        if rb.base <= seq < rb.base + self.W:
+            rb.store(seq, payload, checksum)
+            if seq == rb.base:
+                return rb.advance(), seq
+        return (), seq
+    
+    def sack(self):
+        """Receiver's selective ACK: (cumulative ACK = recv_base, bitmap of frames buffered above it)."""
+        return self.recv_buffer.base, self.recv_buffer.mask
     
     def get_recv_base(self):
         """Return receiver's next expected sequence."""
@@ -1,30 +1,49 @@
+import hashlib
+import math
+import os
 import random
-from config import *
+import numpy as np
+from config import DEFAULT_PARAMS
+
+BLOCK_SIZE = 65536  # Frames per block of pre-generated channel draws
+
+# Recorded channel traces (channel="trace"): one GOOD/BAD bit per time slot
+TRACE_DIR = "channel_traces"
+TRACE_DURATION = 1000.0  # Seconds recorded up front; longer runs extend the trace
+# One slot per transmission time of a frame with this payload, so replaying at this L
+# back-to-back reproduces the per-frame Gilbert-Elliot statistics
+TRACE_REFERENCE_L = 1024
 
 class PhysicalLayer:
-    def __init__(self, seed=None):
+    def __init__(self, seed=None, params=DEFAULT_PARAMS):
         """
         Initializes the physical layer.
         A different seed is used for each scenario to change the error distribution.
+        Each instance owns its RNG, so concurrent runs never share random state.
+        params (SimParams) supplies the rate, delays and Gilbert-Elliot parameters.
         """
-        if seed is not None:
-            random.seed(seed)
+        self.rng = random.Random(seed)
         
         # Initially the channel is in 'GOOD' state
         self.current_state = "GOOD"
         
-        # Fixed Parameters (from config.py)
-        self.bit_rate = BIT_RATE             # 10 Mbps
-        self.p_gb = P_G_TO_B                 # G -> B transition: 0.002
-        self.p_bg = P_B_TO_G                 # B -> G transition: 0.05
-        self.ber_good = BER_GOOD             # 1e-6
-        self.ber_bad = BER_BAD               # 5e-3
+        # Fixed Parameters (defaults from config.py)
+        self.params = params
+        self.bit_rate = params.bit_rate      # 10 Mbps
+        self.p_gb = params.p_g_to_b          # G -> B transition: 0.002
+        self.p_bg = params.p_b_to_g          # B -> G transition: 0.05
+        self.ber_good = params.ber_good      # 1e-6
+        self.ber_bad = params.ber_bad        # 5e-3
+        
+        # Per-frame-size constants, derived once: only a few frame sizes per run
+        self._delays = {"forward": {}, "reverse": {}}  # direction -> {frame size: delay}
+        self._p_success = {}                           # (state, frame size) -> P_success
 
     def _update_state(self):
         """
         Gilbert-Elliot State Transition: Updates the channel state after each frame transmission.
         """
-        r = random.random()
+        r = self.rng.random()
         if self.current_state == "GOOD":
             if r < self.p_gb:
                 self.current_state = "BAD"
@@ -35,33 +54,217 @@ class PhysicalLayer:
     def calculate_delay(self, frame_size_bytes, direction="forward"):
         """
         Total Delay = Transmission Delay + Propagation Delay + Processing Delay
+        (computed once per frame size and direction)
         """
-        # 1. Transmission Delay (L_bits / R)
-        tx_delay = (frame_size_bytes * 8) / self.bit_rate
-        
-        # 2. Propagation Delay (Depends on direction)
-        prop_delay = FORWARD_PROP_DELAY if direction == "forward" else REVERSE_PROP_DELAY
-        
-        # 3. Processing Delay (Per frame)
-        proc_delay = PROCESSING_DELAY
-        
-        return tx_delay + prop_delay + proc_delay
+        delays = self._delays[direction]
+        delay = delays.get(frame_size_bytes)
+        if delay is None:
+            if direction == "forward":
+                delay = self.params.forward_delay(frame_size_bytes)
+            else:
+                delay = self.params.reverse_delay(frame_size_bytes)
+            delays[frame_size_bytes] = delay
+        return delay
 
-    def check_error(self, frame_size_bytes):
+    def check_error(self, frame_size_bytes, tx_time=None):
         """
         Determines whether the frame is corrupted according to the Gilbert-Elliot model.
+        tx_time (start of transmission) is only used by trace-driven channels.
         """
         # First update channel state (for burst effect)
         self._update_state()
         
-        # Select the BER value of the current state
-        ber = self.ber_good if self.current_state == "GOOD" else self.ber_bad
+        p_success = self.success_probability(self.current_state, frame_size_bytes)
         
-        # Total number of bits in the frame
-        num_bits = frame_size_bytes * 8
+        # If random number is greater than p_success, the frame is corrupted
+        return self.rng.random() > p_success
+
+    def success_probability(self, state, frame_size_bytes):
+        """
+        Probability of the frame reaching error-free in the given state: P_success = (1 - BER)^N
+        """
+        key = (state, frame_size_bytes)
+        p_success = self._p_success.get(key)
+        if p_success is None:
+            p_success = self.params.success_probability(state, frame_size_bytes)
+            self._p_success[key] = p_success
+        return p_success
+
+
+class BlockPhysicalLayer(PhysicalLayer):
+    """
+    Gilbert-Elliot channel whose draws are generated in NumPy blocks.
+
+    Random stream (reproducible per seed): SeedSequence(seed) is spawned into three
+    independent numpy Generators:
+    - good_rng: the i-th value is the length (in frames) of the i-th GOOD sojourn,
+      Geometric(p_g_to_b);
+    - bad_rng:  the i-th value is the length of the i-th BAD sojourn, Geometric(p_b_to_g);
+    - error_rng: the k-th uniform decides frame k (corrupted if u_k > P_success).
+    The chain starts GOOD and transitions before every frame, exactly like the scalar
+    PhysicalLayer, so the per-frame state process has the same Markov statistics.
+    Because each stream is consumed in order, the draws do not depend on block_size.
+    """
+    def __init__(self, seed=None, block_size=BLOCK_SIZE, params=DEFAULT_PARAMS):
+        super().__init__(seed, params)
+        good_seq, bad_seq, error_seq = np.random.SeedSequence(seed).spawn(3)
+        self.good_rng = np.random.default_rng(good_seq)
+        self.bad_rng = np.random.default_rng(bad_seq)
+        self.error_rng = np.random.default_rng(error_seq)
+        self.block_size = block_size
         
-        # Probability of the frame reaching error-free: P_success = (1 - BER)^N
-        p_success = (1 - ber) ** num_bits
+        # Current sojourn: the initial GOOD state (before the first frame) uses one slot
+        self._run_bad = False
+        self._run_left = int(self.good_rng.geometric(self.p_gb)) - 1
         
-        # If random number is greater than p_success, the frame is corrupted
-        return random.random() > p_success
\ No newline at end of file
+        self._bad = np.zeros(0, dtype=bool)  # Per-frame state of the current block (True = BAD)
+        self._uniforms = None
+        self._outcomes = {}                  # frame size -> per-frame corrupted flags
+        self._pos = 0
+    
+    @property
+    def current_state(self):
+        """State used by the most recent frame."""
+        if self._pos == 0:
+            return "GOOD"
+        return "BAD" if self._bad[self._pos - 1] else "GOOD"
+    
+    @current_state.setter
+    def current_state(self, value):
+        # The base initializer assigns the initial state; block draws always start GOOD
+        pass
+    
+    def _next_block(self):
+        """Generates the states and corruption uniforms of the next block_size frames."""
+        n = self.block_size
+        bad = np.empty(n, dtype=bool)
+        filled = 0
+        while filled < n:
+            if self._run_left == 0:
+                self._run_bad = not self._run_bad
+                if self._run_bad:
+                    self._run_left = int(self.bad_rng.geometric(self.p_bg))
+                else:
+                    self._run_left = int(self.good_rng.geometric(self.p_gb))
+            take = min(self._run_left, n - filled)
+            bad[filled : filled + take] = self._run_bad
+            filled += take
+            self._run_left -= take
+        
+        self._bad = bad
+        self._uniforms = self.error_rng.random(n)
+        self._outcomes = {}
+        self._pos = 0
+    
+    def check_error(self, frame_size_bytes, tx_time=None):
+        """
+        Determines whether the frame is corrupted; a lookup into the current block.
+        """
+        if self._pos == len(self._bad):
+            self._next_block()
+        
+        outcomes = self._outcomes.get(frame_size_bytes)
+        if outcomes is None:
+            p_good = self.success_probability("GOOD", frame_size_bytes)
+            p_bad = self.success_probability("BAD", frame_size_bytes)
+            outcomes = (self._uniforms > np.where(self._bad, p_bad, p_good)).tolist()
+            self._outcomes[frame_size_bytes] = outcomes
+        
+        corrupted = outcomes[self._pos]
+        self._pos += 1
+        return corrupted
+
+def trace_slot(params=DEFAULT_PARAMS):
+    """Duration of one trace slot under params."""
+    return params.tx_delay(params.frame_bytes(TRACE_REFERENCE_L))
+
+
+def trace_path(seed, trace_dir=TRACE_DIR, params=DEFAULT_PARAMS):
+    """Trace file of seed; named after the parameters that shape the timeline."""
+    channel = repr((params.p_g_to_b, params.p_b_to_g, trace_slot(params))).encode()
+    return os.path.join(trace_dir, f"ge_seed{seed}_{hashlib.sha256(channel).hexdigest()[:12]}.npy")
+
+
+def _trace_slots(duration, params):
+    """Slots recorded for a trace covering duration: whole blocks of BLOCK_SIZE."""
+    return math.ceil(duration / trace_slot(params) / BLOCK_SIZE) * BLOCK_SIZE
+
+
+def record_trace(seed, trace_dir=TRACE_DIR, duration=TRACE_DURATION, params=DEFAULT_PARAMS):
+    """
+    Records the GOOD/BAD timeline of seed's channel: the BlockPhysicalLayer state
+    sequence with one state per trace slot, stored as packed bits (1 = BAD) in a .npy.
+    Returns the path; an existing trace is kept if it covers duration, otherwise it
+    is recorded again for the longer duration (the state sequence does not depend
+    on the length, so the shorter trace is a prefix of the longer one).
+    """
+    path = trace_path(seed, trace_dir, params)
+    n_slots = _trace_slots(duration, params)
+    if os.path.exists(path) and len(np.load(path, mmap_mode="r")) * 8 >= n_slots:
+        return path
+    channel = BlockPhysicalLayer(seed, params=params)
+    bits = []
+    for _ in range(n_slots // BLOCK_SIZE):
+        channel._next_block()
+        bits.append(np.packbits(channel._bad))
+    
+    os.makedirs(trace_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.concatenate(bits))
+    os.replace(tmp_path, path)  # Workers recording concurrently never see a partial file
+    return path
+
+
+_traces = {}  # path -> memory-mapped packed bits, shared by every engine in the process
+
+def load_trace(seed, trace_dir=TRACE_DIR, params=DEFAULT_PARAMS, duration=TRACE_DURATION):
+    """
+    Memory-maps seed's trace, covering at least duration (recording it first if
+    needed); the pages are shared across processes.
+    """
+    path = record_trace(seed, trace_dir, duration, params)
+    trace = _traces.get(path)
+    if trace is None or len(trace) * 8 < _trace_slots(duration, params):
+        trace = _traces[path] = np.load(path, mmap_mode="r")
+    return trace
+
+
+class TracePhysicalLayer(PhysicalLayer):
+    """
+    Gilbert-Elliot channel replayed from a recorded trace (common random numbers).
+
+    The channel state is a function of time - the state of the slot in which the
+    frame's transmission starts - so every (W, L) run with the same seed sees the
+    same bursts at the same instants. Only the per-frame corruption draw
+    (u > P_success of the frame's size in that state) comes from this instance's RNG.
+    """
+    def __init__(self, seed=None, trace_dir=TRACE_DIR, params=DEFAULT_PARAMS):
+        super().__init__(seed, params)
+        self.seed = seed
+        self.trace_dir = trace_dir
+        self.trace = load_trace(seed, trace_dir, params)
+        self.n_slots = len(self.trace) * 8
+        self.slot = trace_slot(params)
+    
+    def state_at(self, t):
+        """Channel state at time t (a run outlasting the trace extends it, never wraps)."""
+        slot = int(t / self.slot)
+        if slot >= self.n_slots:
+            self._extend(slot)
+        bad = (self.trace[slot >> 3] >> (7 - (slot & 7))) & 1
+        return "BAD" if bad else "GOOD"
+    
+    def _extend(self, slot):
+        """Switches to a trace covering slot, at least doubling the recorded duration."""
+        duration = max(2 * self.n_slots, slot + 1) * self.slot
+        self.trace = load_trace(self.seed, self.trace_dir, self.params, duration)
+        self.n_slots = len(self.trace) * 8
+    
+    def check_error(self, frame_size_bytes, tx_time=None):
+        """
+        Determines whether the frame transmitted from tx_time is corrupted.
+        """
+        self.current_state = self.state_at(tx_time)
+        p_success = self.success_probability(self.current_state, frame_size_bytes)
+        return self.rng.random() > p_success
@@ -1,74 +1,267 @@
 # transport.py - Transport Layer with Buffer Management and Backpressure
 
-from config import RECEIVER_BUFFER_SIZE, TRANSPORT_HEADER_SIZE
-from models import Segment
+from config import DEFAULT_PARAMS, L_VALUES
+from models import AbstractSegmentSource, SegmentSource, VariableSegmentSource
+from layers.window import RecvWindow
+from array import array
+import math
 import struct
 import zlib
 
+
+class PayloadAdapter:
+    """
+    Link adaptation: picks each new segment's payload size from an online estimate of
+    the channel's bit error rate. The sender reports every transmission (sent), the
+    transmission a SACK echoes (delivered) and every transmission found lost (lost).
+    Gilbert-Elliot bursts destroy frames of every size alike, so the estimate only
+    counts transmissions that directly follow a delivered one on the wire: their loss
+    rate q is that of the good state, where bit errors grow with frame length. With
+    EWMAs of q and of those frames' size, ber = -ln(1 - q) / frame bits.
+    Each candidate size s is scored by its expected goodput, the smaller of
+    - the link-limited rate p * bit_rate * s / frame_bytes(s), with the frame success
+      probability p = exp(-8 * ber * frame_bytes(s)), and
+    - the window-limited rate window * 8s / (rtt * rounds): a Selective Repeat window
+      moves on once all of its frames are delivered, which takes about
+      rounds = 1 + ln(window) / ln(1 / (1 - p)) round trips (the expected largest
+      number of attempts among window frames).
+    Segments keep their size through retransmissions, so until warmup transmissions
+    have been counted the smallest size is used rather than guessing large.
+    """
+    gain = 1 / 32   # EWMA weight of one counted transmission (after the first 32)
+    warmup = 8      # Counted transmissions before the estimate is used
+    history = 4096  # Transmissions whose outcome is kept (ring size)
+    
+    def __init__(self, max_size, params=DEFAULT_PARAMS, sizes=L_VALUES):
+        self.params = params
+        self.sizes = sorted({size for size in sizes if size < max_size} | {max_size})
+        self.loss_rate = 0.0
+        self.frame_bits = 0.0
+        self.counted = 0
+        
+        # Transmission i (in send order) sits in ring slot i % history
+        self.sent_count = 0
+        self.index = {}  # tx_time -> transmission index, for the transmissions in the ring
+        self.tx_times = [None] * self.history
+        self.frame_sizes = [0] * self.history
+        self.outcomes = bytearray(self.history)  # 0 unknown, 1 delivered, 2 lost
+    
+    def sent(self, tx_time, frame_bytes):
+        i = self.sent_count % self.history
+        if self.tx_times[i] is not None:
+            del self.index[self.tx_times[i]]
+        self.tx_times[i] = tx_time
+        self.frame_sizes[i] = frame_bytes
+        self.outcomes[i] = 0
+        self.index[tx_time] = self.sent_count
+        self.sent_count += 1
+    
+    def delivered(self, tx_time):
+        self._outcome(tx_time, 1)
+    
+    def lost(self, tx_time):
+        self._outcome(tx_time, 2)
+    
+    def _outcome(self, tx_time, outcome):
+        n = self.index.get(tx_time)
+        if n is None or self.outcomes[n % self.history]:
+            return  # Forgotten, or already known
+        self.outcomes[n % self.history] = outcome
+        previous_known = n > 0 and n - 1 >= self.sent_count - self.history
+        if previous_known and self.outcomes[(n - 1) % self.history] == 1:
+            self._count(n)
+        if outcome == 1 and n + 1 < self.sent_count and self.outcomes[(n + 1) % self.history]:
+            self._count(n + 1)
+    
+    def _count(self, n):
+        """Transmission n followed a delivered one: feed its outcome to the estimate."""
+        i = n % self.history
+        self.counted += 1
+        gain = max(self.gain, 1 / self.counted)  # Running mean until the EWMA takes over
+        self.loss_rate += gain * ((self.outcomes[i] == 2) - self.loss_rate)
+        self.frame_bits += gain * (8 * self.frame_sizes[i] - self.frame_bits)
+    
+    @property
+    def ber(self):
+        return -math.log1p(-min(self.loss_rate, 0.999)) / self.frame_bits
+    
+    def next_size(self, window, rtt):
+        """Payload size of the next new segment for a send window of window frames."""
+        if self.counted < self.warmup:
+            return self.sizes[0]
+        params, ber = self.params, self.ber
+        best_size, best_rate = self.sizes[0], -1.0
+        for size in self.sizes:
+            frame_bytes = params.frame_bytes(size)
+            p = math.exp(-8 * ber * frame_bytes)
+            rounds = 1 + math.log(window) / -math.log1p(-p) if p < 1 else 1
+            rate = min(p * params.bit_rate * size / frame_bytes, window * 8 * size / (rtt * rounds))
+            if rate > best_rate:
+                best_size, best_rate = size, rate
+        return best_size
+
+
 class TransportLayer:
-    def __init__(self, segment_payload_size):
+    def __init__(self, segment_payload_size, drain_rate=None, params=DEFAULT_PARAMS, receive_window=None):
         self.L = segment_payload_size
-        self.buffer_capacity = RECEIVER_BUFFER_SIZE  # 256 KB
+        self.buffer_capacity = params.receiver_buffer_size  # 256 KB
+        
+        # Receiver state: the in-order region of a RecvWindow ring, normally shared
+        # with the LinkLayer (which puts frames in order there); standalone, its own
+        # ring that receive_segment fills directly
+        if receive_window is None:
+            receive_window = RecvWindow(1, self.buffer_capacity // self.L + 2, self.buffer_capacity, self.L)
+        self.receive_window = receive_window
         
-        # Receiver state
-        self.receive_buffer = {}  # {seq_num: data}
-        self.current_buffer_usage = 0
-        self.next_expected_seq = 0
-        self.delivered_count = 0
+        # Fluid application reader (bytes/sec). None = driven by explicit app_consume calls.
+        self.drain_rate = drain_rate
+        self.drain_time = 0.0    # Time the reader state was last brought up to date
+        self.drain_credit = 0.0  # Bytes already read from the next in-order segment
+        
+        # Per-segment CRC32 cache (-1 = not computed yet), filled by segment_checksum()
+        self.source = None
+        self.checksums = None
+        self.checksums_computed = 0
+        self.checksums_avoided = 0
         
     # === SENDER SIDE ===
     
-    def segmentize(self, total_data):
-        """Segment data into L-sized chunks with 8-byte header."""
-        segments = []
-        for i in range(0, len(total_data), self.L):
-            chunk = total_data[i : i + self.L]
-            seq_num = i // self.L
-            segments.append(Segment(seq_num, chunk))
-        return segments
+    def segmentize(self, total_data, variable=False):
+        """
+        Segment data into L-sized chunks with 8-byte header.
+        Returns a lazy SegmentSource; segments are zero-copy views of total_data.
+        If total_data is an int, the transfer is payload-free: segments only carry
+        lengths (AbstractSegmentSource) and no checksums are computed.
+        With variable=True nothing is cut up front: cut_segment() cuts each segment
+        with its own size (VariableSegmentSource).
+        """
+        if variable:
+            self.source = VariableSegmentSource(total_data)
+            self.checksums = None if isinstance(total_data, int) else array('q')
+            return self.source
+        
+        if isinstance(total_data, int):
+            self.source = AbstractSegmentSource(total_data, self.L)
+            self.checksums = None
+            return self.source
+        
+        self.source = SegmentSource(total_data, self.L)
+        self.checksums = array('q', [-1]) * len(self.source)
+        return self.source
+    
+    def cut_segment(self, size):
+        """Variable segmentation: cuts the next segment with up to size payload bytes."""
+        if self.checksums is not None:
+            self.checksums.append(-1)
+        return self.source.cut(size)
+    
+    def precompute_checksums(self):
+        """Batched pass computing the checksum of every segment up front."""
+        checksums = self.checksums
+        if checksums is None:
+            return
+        for seq_num in range(len(self.source)):
+            if checksums[seq_num] < 0:
+                checksums[seq_num] = self.compute_checksum(self.source[seq_num].data)
+                self.checksums_computed += 1
     
     def compute_checksum(self, data):
         """Compute CRC32 checksum for integrity verification."""
         return zlib.crc32(data) & 0xFFFFFFFF
     
-    def verify_integrity(self, data, expected_checksum):
-        """Verify data integrity using checksum."""
+    def segment_checksum(self, seq_num, data):
+        """
+        CRC32 of segment seq_num, computed once and reused for every (re)transmission.
+        Returns None for payload-free transfers, which skips the receiver integrity check.
+        """
+        if self.checksums is None:
+            return None
+        crc = self.checksums[seq_num]
+        if crc < 0:
+            crc = self.compute_checksum(data)
+            self.checksums[seq_num] = crc
+            self.checksums_computed += 1
+        else:
+            self.checksums_avoided += 1
+        return crc
+    
+    def verify_integrity(self, data, expected_checksum, seq_num=None):
+        """
+        Verify data integrity using checksum.
+        Payloads that are views of this layer's own segmented buffer reuse the cached
+        checksum of seq_num; any other payload is hashed.
+        """
+        if (seq_num is not None and self.checksums is not None
+                and getattr(data, 'obj', None) is self.source.buffer
+                and self.checksums[seq_num] >= 0):
+            self.checksums_avoided += 1
+            return self.checksums[seq_num] == expected_checksum
         return self.compute_checksum(data) == expected_checksum
     
     # === RECEIVER SIDE ===
     
+    @property
+    def current_buffer_usage(self):
+        """Bytes received in order and not yet read by the application."""
+        return self.receive_window.ready_bytes
+    
+    @property
+    def next_expected_seq(self):
+        return self.receive_window.read_base
+    
+    @property
+    def delivered_count(self):
+        """Segments read by the application."""
+        return self.receive_window.read_base
+    
     def can_accept(self, data_size):
         """Check if buffer has space for incoming segment."""
-        return self.current_buffer_usage + data_size <= self.buffer_capacity
+        return self.receive_window.ready_bytes + data_size <= self.buffer_capacity
     
     def get_buffer_usage_percent(self):
         """Return buffer usage as percentage."""
-        return (self.current_buffer_usage / self.buffer_capacity) * 100
+        return (self.receive_window.ready_bytes / self.buffer_capacity) * 100
     
     def should_delay_ack(self):
         """Delayed ACK when buffer > 80% full."""
-        return self.get_buffer_usage_percent() > 80
+        return (self.receive_window.ready_bytes / self.buffer_capacity) * 100 > 80
+    
+    def receive_in_order(self, seqs):
+        """
+        Integrity check of the segments the link layer just put in order (seqs, a range)
+        in the shared receive window. A corrupted segment is taken back out together
+        with the ones after it, and False is returned.
+        """
+        if self.checksums is None:
+            return True  # Payload-free transfers carry no checksums
+        rb = self.receive_window
+        capacity, payloads, checksums = rb.capacity, rb.payloads, rb.checksums
+        for seq in seqs:
+            i = seq % capacity
+            if checksums[i] is not None and not self.verify_integrity(payloads[i], checksums[i], seq):
+                rb.reject(seq)
+                return False
+        return True
     
     def receive_segment(self, seq_num, data, checksum=None):
         """
-        Accept segment into buffer with integrity verification.
+        Accept an in-order segment straight into the buffer (no link layer) with
+        integrity verification.
         Returns: (success, should_ack)
         """
-        data_size = len(data)
-        
         # Integrity check if checksum provided
         if checksum is not None:
-            if not self.verify_integrity(data, checksum):
+            if not self.verify_integrity(data, checksum, seq_num):
                 return False, False  # Corrupted, reject
         
-        # Backpressure: reject if buffer full
-        if not self.can_accept(data_size):
-            return False, False
-        
-        # Store if not duplicate
-        if seq_num not in self.receive_buffer:
-            self.receive_buffer[seq_num] = data
-            self.current_buffer_usage += data_size
+        rb = self.receive_window
+        if seq_num == rb.base and not rb.blocked:
+            # Backpressure: reject if buffer full
+            if rb.ready_bytes + len(data) > self.buffer_capacity:
+                return False, False
+            rb.push(data, checksum)
+        elif seq_num > rb.base:
+            return False, False  # Out of order: needs the link layer's reorder window
         
         # Decide if ACK should be delayed
         should_ack = not self.should_delay_ack()
@@ -78,23 +271,58 @@ class TransportLayer:
     def app_consume(self, max_bytes):
         """
         Application layer consumes data from buffer.
-        Removes in-order delivered segments.
+        Removes whole in-order segments until max_bytes are consumed (one slice of
+        the receive window).
         Returns bytes consumed.
         """
-        consumed = 0
+        rb = self.receive_window
+        if max_bytes <= 0 or rb.read_base == rb.base:
+            return 0
         
-        while self.next_expected_seq in self.receive_buffer and consumed < max_bytes:
-            data = self.receive_buffer[self.next_expected_seq]
-            data_size = len(data)
-            
-            del self.receive_buffer[self.next_expected_seq]
-            self.current_buffer_usage -= data_size
-            self.delivered_count += 1
-            consumed += data_size
-            self.next_expected_seq += 1
+        # Fewest segments reaching max_bytes (all of them if they fall short)
+        consumed = rb.release(rb.readable(max_bytes, reach=True))
+        if rb.blocked:
+            self._refill()
+        return consumed
+    
+    def drain(self, current_time):
+        """
+        Advances the fluid reader to current_time.
+        The reader consumes in-order data continuously at drain_rate and releases a
+        segment's buffer space once it has been read completely. It idles (and banks
+        no credit) while the next in-order segment has not arrived yet.
+        Returns bytes consumed.
+        """
+        budget = self.drain_credit + (current_time - self.drain_time) * self.drain_rate
+        self.drain_time = current_time
+        rb = self.receive_window
+        if rb.read_base == rb.base:
+            self.drain_credit = 0.0
+            return 0
+        if rb.in_order_size(1) > budget:
+            self.drain_credit = budget  # Still reading the next segment
+            return 0
         
+        consumed = rb.release(rb.readable(budget))
+        budget -= consumed
+        if rb.blocked:
+            self._refill()
+        self.drain_credit = budget if rb.read_base < rb.base else 0.0
         return consumed
     
+    def _refill(self):
+        """Takes in the frames that waited at the head of the link window for buffer space."""
+        self.receive_in_order(self.receive_window.advance())
+    
+    def next_release_time(self):
+        """Time at which the fluid reader frees the next segment, or None if it is idle."""
+        rb = self.receive_window
+        if rb.read_base == rb.base:
+            return None
+        release = self.drain_time + (rb.in_order_size(1) - self.drain_credit) / self.drain_rate
+        # Rounding can leave the credit a hair short of the segment: still move time on
+        return release if release > self.drain_time else math.nextafter(self.drain_time, math.inf)
+    
     def get_next_expected(self):
         """Return next expected in-order sequence number."""
         return self.next_expected_seq
@@ -0,0 +1,259 @@
+# window.py - Ring-buffer state stores for the Selective Repeat windows
+
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class SendWindow:
+    """
+    Sender window state for sequence numbers [base, next_seq).
+    Per-frame state lives in fixed-size parallel arrays indexed by seq % capacity,
+    so registering, acknowledging and sliding never allocate.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.base = 0
+        self.next_seq = 0
+        self.unacked = 0  # Frames in [base, next_seq) not yet acknowledged
+
+        self.frames = [None] * capacity
+        self.send_times = [0.0] * capacity
+        self.acked = bytearray(capacity)
+        self.retransmitted = bytearray(capacity)
+
+    def __contains__(self, seq):
+        """True while seq is registered and has not slid out of the window."""
+        return self.base <= seq < self.next_seq
+
+    def __len__(self):
+        return self.next_seq - self.base
+
+    def add(self, frame, send_time):
+        """Registers frame under the next sequence number and returns that number."""
+        seq = self.next_seq
+        i = seq % self.capacity
+        self.frames[i] = frame
+        self.send_times[i] = send_time
+        self.acked[i] = 0
+        self.retransmitted[i] = 0
+        self.next_seq += 1
+        self.unacked += 1
+        return seq
+
+    def mark_acked(self, seq):
+        """Acknowledges seq and slides the base past every leading acked frame."""
+        i = seq % self.capacity
+        if self.acked[i]:
+            return
+        self.acked[i] = 1
+        self.unacked -= 1
+
+        if seq == self.base:
+            capacity, acked, frames = self.capacity, self.acked, self.frames
+            base, next_seq = self.base, self.next_seq
+            while base < next_seq and acked[base % capacity]:
+                frames[base % capacity] = None
+                base += 1
+            self.base = base
+
+
+class RecvWindow:
+    """
+    Receive buffer shared by the link and transport layers: one ring of slots indexed
+    by seq % capacity.
+    - [base, base + window) is the Selective Repeat reorder window. Out-of-order
+      (payload, checksum) pairs wait here, flagged in the present bitmap; len() and
+      bytes count them, and mask mirrors them relative to base (bit i = seq base + i),
+      for SACKs.
+    - [read_base, base) holds the in-order frames handed to the transport and not yet
+      read by the application (ready_bytes of payload), so a reader takes any prefix
+      by moving read_base.
+    Handing frames over only moves base: nothing is copied or re-keyed. byte_limit caps
+    ready_bytes (the transport's buffer); frames that do not fit stay at the head of the
+    window (blocked) until the reader frees space. Without a capacity the buffer has no
+    reader and frames are released as soon as they are in order.
+
+    With a segment_size, every payload is expected to have that size except the last
+    of the transfer, and the size of an in-order prefix is a product. Otherwise (or
+    once a short payload turns out not to be the last) ends[seq % capacity] holds the
+    cumulative payload size through seq, and prefixes are found by bisecting it.
+    """
+    def __init__(self, window, capacity=None, byte_limit=math.inf, segment_size=None):
+        self.window = window
+        self.reader = capacity is not None
+        self.capacity = capacity if self.reader else window
+        self.byte_limit = byte_limit
+        self.base = 0
+        self.count = 0
+        self.bytes = 0
+        self.mask = 0
+        self.blocked = False
+        
+        # In-order region, with the cumulative payload bytes read so far (the bytes
+        # handed over are read_bytes + ready_bytes)
+        self.read_base = 0
+        self.ready_bytes = 0
+        self.read_bytes = 0
+        self.segment_size = segment_size  # None while ends is in use
+        self.expected = segment_size      # Handed payloads of another size go through _irregular
+
+        self.payloads = [None] * self.capacity
+        self.checksums = [None] * self.capacity
+        self.present = bytearray(self.capacity)
+        self.ends = array('q', [0]) * self.capacity
+
+    def __contains__(self, seq):
+        return self.base <= seq < self.base + self.window and self.present[seq % self.capacity]
+
+    def __len__(self):
+        return self.count
+
+    def store(self, seq, payload, checksum):
+        """Buffers seq unless it is already held. seq must lie inside the window."""
+        i = seq % self.capacity
+        if not self.present[i]:
+            self.payloads[i] = payload
+            self.checksums[i] = checksum
+            self.present[i] = 1
+            self.count += 1
+            self.bytes += len(payload)
+            self.mask |= 1 << (seq - self.base)
+
+    def advance(self):
+        """
+        Hands every buffered frame from base on to the reader, as far as byte_limit
+        allows, and returns their seqs (a range).
+        """
+        capacity, present, payloads = self.capacity, self.present, self.payloads
+        start = base = self.base
+        i = base % capacity
+        if not self.reader:
+            checksums = self.checksums
+            moved_bytes = 0
+            while present[i]:
+                moved_bytes += len(payloads[i])
+                payloads[i] = None
+                checksums[i] = None
+                present[i] = 0
+                base += 1
+                i = base % capacity
+            self.read_base = base
+        else:
+            handed = start_handed = self.read_bytes + self.ready_bytes
+            limit = self.read_bytes + self.byte_limit
+            while present[i]:
+                size = len(payloads[i])
+                if handed + size > limit:
+                    break
+                handed += size
+                if size != self.expected:
+                    self._irregular(base, size, handed)
+                present[i] = 0
+                base += 1
+                i = base % capacity
+            self.blocked = bool(present[i])
+            moved_bytes = handed - start_handed
+            self.ready_bytes += moved_bytes
+        moved = base - start
+        self.count -= moved
+        self.bytes -= moved_bytes
+        self.mask >>= moved
+        self.base = base
+        return range(start, base)
+
+    def push(self, payload, checksum):
+        """Hands frame base, arriving in order and not buffered, straight to the reader."""
+        base = self.base
+        i = base % self.capacity
+        self.payloads[i] = payload
+        self.checksums[i] = checksum
+        size = len(payload)
+        self.ready_bytes += size
+        if size != self.expected:
+            self._irregular(base, size, self.read_bytes + self.ready_bytes)
+        self.mask >>= 1
+        self.base = base + 1
+
+    def _irregular(self, seq, size, end):
+        """Size bookkeeping of handed frame seq, of size bytes ending at cumulative byte end."""
+        if self.segment_size is not None:
+            if self.expected is not None:
+                self.expected = None  # A short payload: the last, unless another follows
+                return
+            # One does follow: keep ends from now on, filling it in for the frames held
+            ends, capacity, segment_size = self.ends, self.capacity, self.segment_size
+            read_base, read_bytes = self.read_base, self.read_bytes
+            for s in range(read_base, seq - 1):
+                ends[s % capacity] = read_bytes + (s - read_base + 1) * segment_size
+            if seq > read_base:
+                ends[(seq - 1) % capacity] = end - size
+            self.segment_size = None
+        self.ends[seq % self.capacity] = end
+
+    def reject(self, seq):
+        """Takes back the frames handed over from seq on, dropping seq itself (failed integrity check)."""
+        capacity, payloads, present = self.capacity, self.payloads, self.present
+        moved = self.base - seq
+        self.ready_bytes = self.in_order_size(seq - self.read_base)
+        self.expected = self.segment_size  # Any short payload handed over was at or after seq
+        i = seq % capacity
+        payloads[i] = None
+        self.checksums[i] = None
+        for s in range(seq + 1, self.base):
+            present[s % capacity] = 1
+        self.count += moved - 1
+        self.bytes += sum(len(payloads[s % capacity]) for s in range(seq + 1, self.base))
+        self.mask = (self.mask << moved) | ((1 << moved) - 2)
+        self.base = seq
+        self.blocked = False
+
+    def in_order_size(self, n):
+        """Payload bytes of the first n in-order frames."""
+        if self.segment_size is not None:
+            return self.ready_bytes if n == self.base - self.read_base else n * self.segment_size
+        return self.ends[(self.read_base + n - 1) % self.capacity] - self.read_bytes if n else 0
+
+    def readable(self, budget, reach=False):
+        """
+        Number of leading in-order frames whose payloads fit in budget bytes; with
+        reach=True, the fewest that reach budget bytes (all of them if they fall short).
+        """
+        available = self.base - self.read_base
+        segment_size = self.segment_size
+        if segment_size is not None:
+            if budget <= 0:
+                return 0
+            if self.ready_bytes <= budget:
+                return available
+            # Only the last frame can be short, and budget ends before it
+            return int(-(-budget // segment_size) if reach else budget // segment_size)
+        if reach and budget <= 0:
+            return 0
+        ends, capacity = self.ends, self.capacity
+        target = self.read_bytes + budget
+        first = self.read_base % capacity
+        last = first + available  # One past the last in-order slot, unwrapped
+        search = bisect_left if reach else bisect_right
+        if last > capacity:
+            # The region wraps: ends is increasing on [first, capacity) and on [0, last - capacity)
+            if ends[capacity - 1] >= target if reach else ends[capacity - 1] > target:
+                n = search(ends, target, first, capacity) - first
+            else:
+                n = capacity - first + search(ends, target, 0, last - capacity)
+        else:
+            n = search(ends, target, first, last) - first
+        if reach and n < available:
+            n += 1
+        return n
+
+    def release(self, n):
+        """Frees the first n in-order frames (read by the application); returns their payload bytes."""
+        if self.segment_size is not None:
+            size = self.ready_bytes if n == self.base - self.read_base else n * self.segment_size
+        else:
+            size = self.ends[(self.read_base + n - 1) % self.capacity] - self.read_bytes if n else 0
+        self.read_base += n
+        self.read_bytes += size
+        self.ready_bytes -= size
+        return size
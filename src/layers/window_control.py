@@ -0,0 +1,108 @@
+# window_control.py - Dynamic send-window policies for the Selective Repeat sender
+
+import math
+from abc import ABC, abstractmethod
+
+
+class WindowController(ABC):
+    """
+    Effective send window in [1, max_window] (max_window = the LinkLayer's ring capacity).
+    LinkLayer reports acknowledged frames, losses (every retransmission) and receiver
+    backpressure (flagged on ACKs, so it arrives one reverse delay late); subclasses
+    decide how the window grows. Losses and backpressure cut it multiplicatively, at
+    most once per loss epoch: a loss only counts if the lost frame was sent after the
+    previous cut, so one Gilbert-Elliot burst (which takes out a whole window) costs
+    a single cut.
+    Channel losses are not congestion: once a full RTT has been acknowledged without
+    a further loss cut the burst is over, and the window is restored to its value
+    before the burst (as TCP undoes a spurious cut). Backpressure cuts are kept.
+    """
+    decrease = 0.5
+
+    def __init__(self, max_window, frame_bytes, bit_rate, initial_window=10):
+        self.max_window = max_window
+        self.frame_bytes = frame_bytes
+        self.bit_rate = bit_rate
+        self.cwnd = float(min(initial_window, max_window))
+        self.ssthresh = float(max_window)
+        self.epoch_start = -math.inf  # Send time from which losses open a new epoch
+        self.last_cut = -math.inf
+        self.undo_cwnd = None  # Window before the current loss burst
+
+    def start(self, link):
+        """Called once by the LinkLayer the controller is attached to."""
+
+    @property
+    def window(self):
+        return max(1, min(self.max_window, int(self.cwnd)))
+
+    def on_ack(self, newly_acked, current_time, link):
+        """newly_acked frames were acknowledged for the first time."""
+        if self.undo_cwnd is not None and current_time - self.last_cut >= link.estimated_rtt:
+            self.cwnd = max(self.cwnd, self.undo_cwnd)
+            self.ssthresh = max(self.ssthresh, self.undo_cwnd)
+            self.undo_cwnd = None
+        self.grow(newly_acked, link)
+
+    @abstractmethod
+    def grow(self, newly_acked, link):
+        """Opens the window for newly_acked acknowledged frames (the policy)."""
+
+    def on_loss(self, send_time, current_time, link):
+        """The frame last sent at send_time is being retransmitted."""
+        if send_time >= self.epoch_start:
+            if self.undo_cwnd is None:
+                self.undo_cwnd = self.cwnd
+            self._cut(current_time)
+
+    def on_backpressure(self, current_time, link):
+        """
+        An ACK reports the receiver buffer filling up (delayed ACK, rejected or blocked
+        segment); cut once per RTT.
+        """
+        if current_time - self.last_cut >= link.estimated_rtt:
+            self.undo_cwnd = None
+            self._cut(current_time)
+
+    def _cut(self, current_time):
+        self.ssthresh = max(self.cwnd * self.decrease, 1.0)
+        self.cwnd = self.ssthresh
+        self.epoch_start = current_time
+        self.last_cut = current_time
+
+
+class AIMDController(WindowController):
+    """Slow start up to ssthresh, then additive increase of one frame per window acknowledged."""
+    def grow(self, newly_acked, link):
+        if self.cwnd < self.ssthresh:
+            self.cwnd = min(self.cwnd + newly_acked, self.ssthresh)
+        else:
+            self.cwnd = min(self.cwnd + newly_acked / self.cwnd, self.max_window)
+
+
+class BDPController(WindowController):
+    """
+    Tracks the bandwidth-delay product: the target window is gain x the frames that
+    fit in one estimated RTT at the link bit rate. Selective Repeat stalls for about
+    an RTT whenever the window base is lost, so the target covers several RTTs.
+    The link rate is known, so it starts at the target rather than slow-starting.
+    After a cut the window climbs back by one frame per acknowledged frame, so it
+    returns to the target within a few RTTs.
+    """
+    gain = 4.0
+
+    def start(self, link):
+        self.cwnd = min(self.target(link), self.max_window)
+
+    def target(self, link):
+        bdp_frames = link.estimated_rtt * self.bit_rate / 8 / self.frame_bytes
+        return max(1.0, math.ceil(self.gain * bdp_frames))
+
+    def grow(self, newly_acked, link):
+        self.cwnd = min(self.cwnd + newly_acked, self.target(link), self.max_window)
+
+
+WINDOW_CONTROLLERS = {
+    "aimd": AIMDController,
+    "bdp": BDPController,
+}
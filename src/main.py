@@ -1,55 +1,326 @@
-import pandas as pd
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from dataclasses import fields, replace
+
 import numpy as np
+from cache import CACHE_DIR, ResultCache, run_key
 from engine import SimulationEngine
-from config import W_VALUES, L_VALUES, TOTAL_DATA_SIZE
-
-def run_experiment():
-    print("Preparing 100 MB test data...")
-    test_data = np.random.bytes(TOTAL_DATA_SIZE)
-    
-    results = []
-    total_runs = len(W_VALUES) * len(L_VALUES) * 10
-    run_num = 0
-    
-    # 360 Simulations (6W x 6L x 10 Seeds)
-    for w in W_VALUES:
-        for l in L_VALUES:
-            for seed in range(10):
-                run_num += 1
-                print(f"\r[{run_num}/{total_runs}] W={w}, L={l}, Seed={seed}...", end="", flush=True)
-                
-                engine = SimulationEngine(W=w, L=l, seed=seed)
-                total_time = engine.run(test_data)
-                
-                # Goodput: Only payload bytes / total time
-                goodput_bps = (TOTAL_DATA_SIZE * 8) / total_time
-                
-                results.append({
-                    "W": w,
-                    "L": l,
-                    "seed": seed,
-                    "goodput": goodput_bps,
-                    "goodput_mbps": goodput_bps / 1e6,
-                    "total_time": total_time,
-                    "retransmissions": engine.retransmissions,
-                    "avg_rtt": engine.avg_rtt,
-                    "utilization": engine.utilization,
-                    "buffer_events": engine.buffer_events,
-                    "delayed_acks": engine.delayed_acks
-                })
-
-    df = pd.DataFrame(results)
-    df.to_csv("simulation_results.csv", index=False)
-    
+from layers.physical import record_trace
+from config import DEFAULT_PARAMS, W_VALUES, L_VALUES, TOTAL_DATA_SIZE
+from optimizer import adaptive_search
+from results import SUMMARY_FILE, GoodputSummary, ResultWriter
+
+SEEDS = range(10)
+TASKS_PER_WORKER = 4  # Runs queued per pool worker; bounds the rows held back for job order
+
+# Test data shared by every run in this process: the payload bytes, or the
+# byte count for payload-free (abstract) runs. Set before the pool is created
+# so forked workers inherit it instead of receiving a pickled copy.
+_test_data = None
+
+
+def make_test_data(data_size, abstract=False):
+    """Returns the transfer handed to SimulationEngine.run."""
+    return data_size if abstract else np.random.bytes(data_size)
+
+
+def _init_worker(data_size, abstract):
+    """Pool initializer: builds the test data if it was not inherited via fork."""
+    global _test_data
+    if _test_data is None:
+        _test_data = make_test_data(data_size, abstract)
+
+
+def run_single(w, l, seed, engine_options=None, tolerance=None):
+    """Runs one simulation and returns its result row."""
+    engine = SimulationEngine(W=w, L=l, seed=seed, **(engine_options or {}))
+    engine.run(_test_data, tolerance=tolerance)
+    return _result_row(w, l, seed, engine)
+
+
+def _result_row(w, l, seed, engine):
+    total_time = engine.current_time
+    data_size = _test_data if isinstance(_test_data, int) else len(_test_data)
+
+    # Goodput: Only payload bytes / total time (steady-state estimate if the run converged)
+    if engine.converged:
+        goodput_bps = engine.goodput_estimate
+    else:
+        goodput_bps = (data_size * 8) / total_time
+
+    return {
+        "W": w,
+        "L": l,
+        "seed": seed,
+        "goodput": goodput_bps,
+        "goodput_mbps": goodput_bps / 1e6,
+        "total_time": total_time,
+        "retransmissions": engine.retransmissions,
+        "avg_rtt": engine.avg_rtt,
+        "utilization": engine.utilization,
+        "buffer_events": engine.buffer_events,
+        "delayed_acks": engine.delayed_acks,
+        "acks_sent": engine.acks_sent,
+        "checksums_avoided": engine.checksums_avoided,
+        "fec": engine.fec_encoder is not None,
+        "parity_frames": engine.parity_frames,
+        "fec_recovered": engine.fec_recovered,
+        "goodput_ci": engine.goodput_ci if engine.converged else 0.0,
+        **(engine.profile.stats() if engine.profile is not None else {})
+    }
+
+
+def parse_params(assignments):
+    """SimParams from NAME=VALUE overrides of the defaults (e.g. ber_bad=1e-3)."""
+    types = {field.name: type(getattr(DEFAULT_PARAMS, field.name)) for field in fields(DEFAULT_PARAMS)}
+    overrides = {}
+    for assignment in assignments:
+        name, _, value = assignment.partition("=")
+        if name not in types:
+            raise ValueError(f"Unknown parameter {name!r} (known: {', '.join(types)})")
+        overrides[name] = types[name](float(value))
+    return replace(DEFAULT_PARAMS, **overrides)
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+def _print_progress(done, total, job, start):
+    elapsed = time.perf_counter() - start
+    eta = elapsed / done * (total - done)
+    w, l, seed = job
+    print(f"\r[{done}/{total}] W={w}, L={l}, Seed={seed} | "
+          f"elapsed {_format_duration(elapsed)}, ETA {_format_duration(eta)}   ",
+          end="", flush=True)
+
+
+def run_sweep(jobs, workers=1, abstract=False, engine_options=None, tolerance=None,
+              cache=None, on_result=None):
+    """
+    Runs every (W, L, seed) job and returns the result rows in job order.
+    Each run owns its RNG, so the rows are identical for any worker count.
+    With a ResultCache, jobs already in the cache are not simulated and every
+    finished run is stored as soon as it arrives, so an interrupted sweep resumes.
+    With on_result, each row is handed to it in job order as soon as it and every
+    earlier row are available, and nothing else is kept; the return value is then None.
+    """
+    cached = [None] * len(jobs)
+    keys = [None] * len(jobs)
+    pending = list(range(len(jobs)))
+    if cache is not None:
+        keys = [run_key(w, l, seed, TOTAL_DATA_SIZE, engine_options, tolerance, abstract)
+                for w, l, seed in jobs]
+        cached = [cache.get(key) for key in keys]
+        pending = [i for i, row in enumerate(cached) if row is None]
+        if len(pending) < len(jobs):
+            print(f"Result cache: {len(jobs) - len(pending)} of {len(jobs)} runs already done.")
+    results = [None] * len(jobs) if on_result is None else None
+    waiting = {}  # Job index -> row finished ahead of an earlier job
+    next_row = 0
+
+    def emit(i, row):
+        nonlocal next_row
+        if on_result is None:
+            results[i] = row
+            return
+        waiting[i] = row
+        while next_row in waiting:
+            on_result(waiting.pop(next_row))
+            next_row += 1
+
+    for i, row in enumerate(cached):
+        if row is not None:
+            emit(i, row)
+
+    start = time.perf_counter()
+    done = 0
+
+    def collect(row, i):
+        nonlocal done
+        if cache is not None:
+            cache.put(keys[i], row)
+        emit(i, row)
+        done += 1
+        _print_progress(done, len(pending), jobs[i], start)
+
+    if not pending:
+        return results
+
+    if workers <= 1:
+        _init_worker(TOTAL_DATA_SIZE, abstract)
+        for i in pending:
+            collect(run_single(*jobs[i], engine_options, tolerance), i)
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(TOTAL_DATA_SIZE, abstract)) as pool:
+        # Runs are submitted in job order, a few per worker at a time, so a row
+        # waits for at most that many earlier ones
+        queue = iter(pending)
+        futures = {}
+
+        def submit(count):
+            for i in islice(queue, count):
+                futures[pool.submit(run_single, *jobs[i], engine_options, tolerance)] = i
+
+        submit(TASKS_PER_WORKER * workers)
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                collect(future.result(), futures.pop(future))
+            submit(len(finished))
+    return results
+
+
+def _prepare_test_data(abstract):
+    global _test_data
+    if abstract:
+        print("Payload-free (abstract) mode: no test data needed.")
+    else:
+        print("Preparing 100 MB test data...")
+    _test_data = make_test_data(TOTAL_DATA_SIZE, abstract)
+
+
+def run_experiment(workers=1, abstract=False, engine_options=None, tolerance=None,
+                   cache=None, results_file="simulation_results.csv", compare_fec=False):
+    """
+    Runs the full (W, L, seed) grid. With compare_fec the grid runs twice, without
+    and with FEC (parity rows carry fec=True), and both are summarised side by side.
+    """
+    _prepare_test_data(abstract)
+
+    # 360 Simulations (6W x 6L x 10 Seeds), per FEC setting
+    jobs = [(w, l, seed) for w in W_VALUES for l in L_VALUES for seed in SEEDS]
+    modes = (False, True) if compare_fec else (None,)
+    total_runs = len(jobs) * len(modes)
+    print(f"Running {total_runs} simulations on {workers} worker(s)...")
+    # Rows are streamed to disk and folded into the per-(W, L) summaries as they finish
+    summaries = {}
+    with ResultWriter(results_file) as writer:
+        for fec in modes:
+            summary = summaries[fec] = GoodputSummary()
+
+            def record(row):
+                writer.write(row)
+                summary.update(row)
+            options = engine_options if fec is None else {**(engine_options or {}), "fec": fec}
+            run_sweep(jobs, workers, abstract, options, tolerance, cache, on_result=record)
+    summary_files = {}
+    for fec, summary in summaries.items():
+        summary_files[fec] = SUMMARY_FILE.replace(".csv", "_fec.csv") if fec else SUMMARY_FILE
+        summary.save(summary_files[fec])
+
     # Print summary
     print("\n\n=== SIMULATION COMPLETE ===")
     print(f"Total runs: {total_runs}")
-    print(f"Results saved to: simulation_results.csv")
-    
+    print(f"Results saved to: {results_file} (per-point summary: {', '.join(summary_files.values())})")
+
+    if compare_fec:
+        print("\nGoodput (Mbps) without / with FEC:")
+        print(f"{'W':>5} {'L':>6} {'ARQ':>8} {'FEC':>8} {'change':>8}")
+        arq, coded = summaries[False].points, summaries[True].points
+        for w, l in sorted(arq):
+            without, with_fec = arq[w, l][1], coded[w, l][1]
+            print(f"{w:>5} {l:>6} {without / 1e6:>8.2f} {with_fec / 1e6:>8.2f} "
+                  f"{100 * (with_fec / without - 1):>+7.1f}%")
+
     # Find optimal
-    avg_results = df.groupby(['W', 'L'])['goodput_mbps'].mean().reset_index()
-    optimal = avg_results.loc[avg_results['goodput_mbps'].idxmax()]
-    print(f"\nOptimal: W={int(optimal['W'])}, L={int(optimal['L'])}, Avg Goodput={optimal['goodput_mbps']:.2f} Mbps")
+    for fec, summary in summaries.items():
+        opt_w, opt_l, opt_goodput = summary.optimum()
+        label = {None: "", False: " without FEC", True: " with FEC"}[fec]
+        print(f"\nOptimal{label}: W={opt_w}, L={opt_l}, Avg Goodput={opt_goodput / 1e6:.2f} Mbps")
+
+
+def run_adaptive(workers=1, abstract=False, engine_options=None, refine_rounds=0, tolerance=None,
+                 cache=None):
+    """Races the (W, L) grid with early elimination instead of running every cell."""
+    _prepare_test_data(abstract)
+
+    def evaluate(jobs):
+        rows = run_sweep(jobs, workers, abstract, engine_options, tolerance=tolerance, cache=cache)
+        return [row["goodput_mbps"] for row in rows]
+
+    best, simulations = adaptive_search(W_VALUES, L_VALUES, evaluate, max_seeds=len(SEEDS),
+                                        refine_rounds=refine_rounds)
+    full_grid = len(W_VALUES) * len(L_VALUES) * len(SEEDS)
+
+    print("\n\n=== ADAPTIVE SEARCH COMPLETE ===")
+    print(f"Simulations: {simulations} (full grid: {full_grid})")
+    print(f"\nOptimal: W={best.W}, L={best.L}, Avg Goodput={best.mean:.2f} "
+          f"\u00b1 {best.half_width:.2f} Mbps (95% CI, {len(best.samples)} seeds)")
+    return best
+
 
 if __name__ == "__main__":
-    run_experiment()
+    parser = argparse.ArgumentParser(description="Selective Repeat ARQ parameter sweep")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (1 = serial)")
+    parser.add_argument("--abstract", action="store_true",
+                        help="simulate sequence numbers and lengths only (no payload bytes)")
+    parser.add_argument("--channel", choices=["scalar", "block", "trace"], default="scalar",
+                        help="Gilbert-Elliot implementation (block = NumPy block draws, "
+                             "trace = one recorded burst timeline per seed, replayed for every (W, L))")
+    parser.add_argument("--app-drain", choices=["fluid", "tick"], default="fluid",
+                        help="application reader model (tick = original 1 ms polling)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="race (W, L) candidates with early elimination instead of the full grid")
+    parser.add_argument("--refine", type=int, default=0, metavar="ROUNDS",
+                        help="with --adaptive: rounds of finer, non-power-of-two search around the optimum")
+    parser.add_argument("--tolerance", type=float, default=None,
+                        help="stop each run once its goodput estimate's relative 95%% CI is below this")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="directory of cached run results (reused across sweeps)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="simulate every run, neither reading nor writing the result cache")
+    parser.add_argument("--results", default="simulation_results.csv", metavar="PATH",
+                        help="streamed per-run results (.parquet needs pyarrow, otherwise CSV)")
+    parser.add_argument("--instrument", action="store_true",
+                        help="add per-run engine profiling columns (event counts, handler times, ...); "
+                             "runs bypass the result cache")
+    parser.add_argument("--ack-every", type=int, default=1, metavar="N",
+                        help="fluid mode: coalesce up to N in-order frames into one selective ACK")
+    parser.add_argument("--ack-delay", type=float, default=None, metavar="SECONDS",
+                        help="with --ack-every: longest a coalesced ACK is held back")
+    parser.add_argument("--window-control", choices=["aimd", "bdp"], default=None,
+                        help="dynamic send window up to W (AIMD on loss, or BDP tracking)")
+    parser.add_argument("--link-adaptation", action="store_true",
+                        help="fluid mode: choose each segment's payload size (up to L) from the channel estimate")
+    parser.add_argument("--fec", action="store_true",
+                        help="fluid mode: run the grid without and with XOR parity FEC and compare goodput")
+    parser.add_argument("--set", nargs="+", default=[], metavar="NAME=VALUE",
+                        help="override simulation parameters, e.g. ber_bad=1e-3 receiver_buffer_size=131072")
+    args = parser.parse_args()
+    if args.fec and args.adaptive:
+        parser.error("--fec compares full grids and cannot be combined with --adaptive")
+    for flag, enabled in (("--fec", args.fec), ("--link-adaptation", args.link_adaptation)):
+        if enabled and args.app_drain == "tick":
+            parser.error(f"{flag} needs selective ACKs, which the fluid model sends; drop --app-drain tick")
+    try:
+        params = parse_params(args.set)
+    except ValueError as e:
+        parser.error(str(e))
+    engine_options = {"channel": args.channel, "app_drain": args.app_drain,
+                      "instrument": args.instrument, "params": params,
+                      "ack_every": args.ack_every, "ack_delay": args.ack_delay,
+                      "window_control": args.window_control, "link_adaptation": args.link_adaptation}
+    # Instrumented rows carry wall-clock timings, which a cached row would serve stale
+    cache = None if args.no_cache or args.instrument else ResultCache(args.cache_dir)
+    if args.channel == "trace":
+        # Record once up front; the workers then only memory-map the traces
+        for seed in SEEDS:
+            record_trace(seed, params=params)
+    if args.adaptive:
+        run_adaptive(workers=args.workers, abstract=args.abstract,
+                     engine_options=engine_options, refine_rounds=args.refine,
+                     tolerance=args.tolerance, cache=cache)
+    else:
+        run_experiment(workers=args.workers, abstract=args.abstract,
+                       engine_options=engine_options,
+                       tolerance=args.tolerance, cache=cache, results_file=args.results,
+                       compare_fec=args.fec)
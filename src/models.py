@@ -1,27 +1,164 @@
 import struct
+from array import array
+
+# 4 byte seq_num + 4 byte CRC32 (zero when not set) = 8 byte header
+SEGMENT_HEADER = struct.Struct('!II')
+# 4 byte seq + 1 byte type + 8 byte timestamp + 11 byte padding = 24 byte header
+FRAME_HEADER = struct.Struct('!IBd11s')
+FRAME_TYPES = {'DATA': 1, 'ACK': 2}
 
 class Segment:
     """Transport Layer Segment"""
-    def __init__(self, seq_num, data):
+    def __init__(self, seq_num, data, checksum=None):
         self.seq_num = seq_num
         self.data = data
+        self.checksum = checksum  # CRC32 of data, carried in the header when set
         self.header_size = 8 
 
+    def pack_parts(self):
+        """Header and payload as separate buffers (no concatenation copy)."""
+        return [SEGMENT_HEADER.pack(self.seq_num, self.checksum or 0), self.data]
+
     def pack(self):
-        # 4 byte seq_num + 4 byte padding = 8 byte header
-        header = struct.pack('!I4s', self.seq_num, b'\x00'*4)
-        return header + self.data
+        return b''.join(self.pack_parts())
+
+    @classmethod
+    def unpack(cls, buffer):
+        """Parses a packed segment; data is a zero-copy view of buffer."""
+        view = memoryview(buffer)
+        seq_num, checksum = SEGMENT_HEADER.unpack_from(view)
+        return cls(seq_num, view[SEGMENT_HEADER.size:], checksum)
+
+
+class SegmentSource:
+    """
+    Lazy, read-only sequence of Segments over one shared buffer.
+    Segments are built on access and reference the buffer through memoryview
+    slices, so segmentation neither copies the data nor keeps per-segment objects alive.
+    """
+    def __init__(self, data, segment_size):
+        self._view = memoryview(data).cast('B')
+        self.buffer = self._view.obj  # Object every segment view refers to
+        self.segment_size = segment_size
+        self._count = -(-len(self._view) // segment_size)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, seq_num):
+        if not 0 <= seq_num < self._count:
+            raise IndexError(seq_num)
+        start = seq_num * self.segment_size
+        return Segment(seq_num, self._view[start : start + self.segment_size])
+
+class AbstractPayload:
+    """Stand-in for segment data in payload-free runs: only its length is modelled."""
+    __slots__ = ('length',)
+
+    def __init__(self, length):
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+
+class AbstractSegmentSource:
+    """
+    Payload-free counterpart of SegmentSource for a transfer of total_size bytes.
+    Segments carry a sequence number and an AbstractPayload length, nothing else.
+    """
+    def __init__(self, total_size, segment_size):
+        self.total_size = total_size
+        self.segment_size = segment_size
+        self._count = -(-total_size // segment_size)
+        self._full = AbstractPayload(segment_size)  # Shared by every full-size segment
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, seq_num):
+        if not 0 <= seq_num < self._count:
+            raise IndexError(seq_num)
+        start = seq_num * self.segment_size
+        if start + self.segment_size <= self.total_size:
+            return Segment(seq_num, self._full)
+        return Segment(seq_num, AbstractPayload(self.total_size - start))
+
+
+class VariableSegmentSource:
+    """
+    Segments cut on demand with a size chosen per segment (link adaptation).
+    data is the transfer's bytes, or an int byte count for a payload-free run
+    (segments then carry AbstractPayloads). Segment seq_num covers bytes
+    [offset(seq_num), offset(seq_num + 1)); len() counts the segments cut so far.
+    """
+    def __init__(self, data):
+        if isinstance(data, int):
+            self._view = None
+            self.buffer = None
+            self.total_size = data
+        else:
+            self._view = memoryview(data).cast('B')
+            self.buffer = self._view.obj
+            self.total_size = len(self._view)
+        self._offsets = array('q', [0])  # Start of every segment, plus the end of the last
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    @property
+    def remaining(self):
+        """Bytes not cut into a segment yet."""
+        return self.total_size - self._offsets[-1]
+
+    def offset(self, seq_num):
+        """Bytes carried by the segments before seq_num."""
+        return self._offsets[seq_num]
+
+    def cut(self, size):
+        """Cuts the next segment of up to size bytes and returns it."""
+        start = self._offsets[-1]
+        end = min(start + size, self.total_size)
+        self._offsets.append(end)
+        return self._segment(len(self._offsets) - 2, start, end)
+
+    def __getitem__(self, seq_num):
+        if not 0 <= seq_num < len(self):
+            raise IndexError(seq_num)
+        return self._segment(seq_num, self._offsets[seq_num], self._offsets[seq_num + 1])
+
+    def _segment(self, seq_num, start, end):
+        if self._view is None:
+            return Segment(seq_num, AbstractPayload(end - start))
+        return Segment(seq_num, self._view[start:end])
+
 
 class Frame:
     """Link Layer Frame (Selective Repeat)"""
-    def __init__(self, seq_num, frame_type, payload):
+    def __init__(self, seq_num, frame_type, payload, timestamp=0.0):
         self.seq_num = seq_num
         self.frame_type = frame_type # 'DATA' or 'ACK'
-        self.payload = payload
+        self.payload = payload # Segment (referenced, not copied) or raw bytes
+        self.timestamp = timestamp # Sender's transmission time (echoed back by ACKs)
         self.header_size = 24
 
+    def pack_parts(self):
+        """Frame header followed by the payload buffers, ready for scatter-gather I/O."""
+        type_code = FRAME_TYPES[self.frame_type]
+        parts = [FRAME_HEADER.pack(self.seq_num, type_code, self.timestamp, b'\x00'*11)]
+        if isinstance(self.payload, Segment):
+            parts.extend(self.payload.pack_parts())
+        else:
+            parts.append(self.payload)
+        return parts
+
     def pack(self):
-        # 4 byte seq + 1 byte type + 19 byte padding = 24 byte header
-        type_code = 1 if self.frame_type == 'DATA' else 2
-        header = struct.pack('!IB19s', self.seq_num, type_code, b'\x00'*19)
-        return header + self.payload
+        return b''.join(self.pack_parts())
+
+    @classmethod
+    def unpack(cls, buffer):
+        """Parses a packed frame; the payload is left as a zero-copy view of buffer (raw bytes)."""
+        view = memoryview(buffer)
+        seq_num, type_code, timestamp, _ = FRAME_HEADER.unpack_from(view)
+        frame_type = 'DATA' if type_code == FRAME_TYPES['DATA'] else 'ACK'
+        return cls(seq_num, frame_type, view[FRAME_HEADER.size:], timestamp)
@@ -0,0 +1,102 @@
+# optimizer.py - Adaptive (W, L) search: racing over seeds with early elimination
+
+import math
+
+from stats import mean_ci
+
+
+class Candidate:
+    """One (W, L) configuration and the goodput samples collected so far."""
+    def __init__(self, W, L):
+        self.W = W
+        self.L = L
+        self.samples = []
+
+    @property
+    def mean(self):
+        return mean_ci(self.samples)[0]
+
+    @property
+    def half_width(self):
+        return mean_ci(self.samples)[1]
+
+    @property
+    def lower(self):
+        return self.mean - self.half_width
+
+    @property
+    def upper(self):
+        return self.mean + self.half_width
+
+
+def race(candidates, evaluate, min_seeds=3, max_seeds=10):
+    """
+    Racing: every surviving candidate is brought up to one more seed per round,
+    and any candidate whose confidence interval lies entirely below the current
+    best's is dropped. Stops when one candidate is left or the survivors reach
+    max_seeds. Candidates may already hold samples; they are reused.
+    evaluate(jobs) runs a list of (W, L, seed) jobs and returns their goodputs.
+    Returns (best candidate, number of simulations run).
+    """
+    alive = list(candidates)
+    simulations = 0
+    n_seeds = min_seeds
+
+    while True:
+        pending = [(c, seed) for c in alive for seed in range(len(c.samples), n_seeds)]
+        if pending:
+            goodputs = evaluate([(c.W, c.L, seed) for c, seed in pending])
+            for (c, _), goodput in zip(pending, goodputs):
+                c.samples.append(goodput)
+            simulations += len(pending)
+
+        best = max(alive, key=lambda c: c.mean)
+        alive = [c for c in alive if c is best or c.upper >= best.lower]
+        if len(alive) == 1 or n_seeds >= max_seeds:
+            return best, simulations
+        n_seeds += 1
+
+
+def refine_values(values, best):
+    """
+    Finer grid around best: best itself plus the geometric midpoints towards
+    its neighbours in values (so powers of two give e.g. 45 between 32 and 64).
+    """
+    values = sorted(values)
+    i = values.index(best)
+    refined = {best}
+    if i > 0:
+        refined.add(round(math.sqrt(values[i - 1] * best)))
+    if i < len(values) - 1:
+        refined.add(round(math.sqrt(best * values[i + 1])))
+    return sorted(refined)
+
+
+def adaptive_search(w_values, l_values, evaluate, min_seeds=3, max_seeds=10, refine_rounds=0):
+    """
+    Looks for the goodput-optimal (W, L) without spending max_seeds on every cell.
+    After racing the initial grid, each refine round races a finer, non-power-of-two
+    grid around the current winner against the winner itself (whose samples are kept).
+    Returns (best candidate, total simulations).
+    """
+    candidates = {(w, l): Candidate(w, l) for w in w_values for l in l_values}
+    best, simulations = race(candidates.values(), evaluate, min_seeds, max_seeds)
+
+    for _ in range(refine_rounds):
+        w_refined = refine_values(w_values, best.W)
+        l_refined = refine_values(l_values, best.L)
+        w_values = sorted(set(w_values) | set(w_refined))
+        l_values = sorted(set(l_values) | set(l_refined))
+
+        round_candidates = [best]
+        for w in w_refined:
+            for l in l_refined:
+                if (w, l) not in candidates:
+                    candidates[(w, l)] = Candidate(w, l)
+                    round_candidates.append(candidates[(w, l)])
+        if len(round_candidates) == 1:
+            break
+        best, used = race(round_candidates, evaluate, min_seeds, max_seeds)
+        simulations += used
+
+    return best, simulations
@@ -0,0 +1,105 @@
+# results.py - Streaming result store and incremental per-(W, L) summaries
+
+import math
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional; CSV works everywhere
+    pa = pq = None
+
+ROW_GROUP_SIZE = 1024  # Rows buffered before a row group / CSV chunk is written
+
+SUMMARY_FILE = "simulation_summary.csv"
+
+
+class ResultWriter:
+    """
+    Append-only result store. Rows are buffered and written in row groups of
+    row_group_size as runs finish, so a sweep never holds its full result set.
+    A path ending in .parquet is written as Parquet (needs pyarrow); anything
+    else is written as CSV, one appended chunk per row group. The columns are fixed
+    by the first row group; later rows are written under them, missing keys empty.
+    """
+    def __init__(self, path, row_group_size=ROW_GROUP_SIZE):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.parquet = path.endswith(".parquet")
+        if self.parquet and pq is None:
+            raise ImportError("Parquet output requires pyarrow; use a .csv path instead")
+        self.rows = 0
+        self._buffer = []
+        self._writer = None
+        self.columns = None
+
+    def write(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered rows as one row group."""
+        if not self._buffer:
+            return
+        if self.parquet:
+            if self._writer is None:
+                table = pa.Table.from_pylist(self._buffer)
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                table = pa.Table.from_pylist(self._buffer, schema=self._writer.schema)
+            self._writer.write_table(table)
+        else:
+            frame = pd.DataFrame(self._buffer)
+            if self.columns is None:
+                self.columns = list(frame.columns)
+            else:
+                frame = frame.reindex(columns=self.columns)
+            frame.to_csv(self.path, mode="w" if self.rows == 0 else "a",
+                         header=self.rows == 0, index=False)
+        self.rows += len(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GoodputSummary:
+    """
+    Running per-(W, L) goodput count, mean and sample variance (Welford's
+    algorithm), updated one row at a time.
+    """
+    def __init__(self):
+        self.points = {}  # (W, L) -> [count, mean, sum of squared deviations]
+
+    def update(self, row):
+        point = self.points.setdefault((row["W"], row["L"]), [0, 0.0, 0.0])
+        point[0] += 1
+        delta = row["goodput"] - point[1]
+        point[1] += delta / point[0]
+        point[2] += delta * (row["goodput"] - point[1])
+
+    def frame(self):
+        """Summary as a DataFrame with columns W, L, count, goodput (mean), goodput_var."""
+        records = [{"W": w, "L": l, "count": n, "goodput": mean,
+                    "goodput_var": m2 / (n - 1) if n > 1 else math.nan}
+                   for (w, l), (n, mean, m2) in sorted(self.points.items())]
+        return pd.DataFrame(records, columns=["W", "L", "count", "goodput", "goodput_var"])
+
+    def optimum(self):
+        """(W, L, mean goodput) of the best point."""
+        (w, l), (_, mean, _) = max(self.points.items(), key=lambda item: item[1][1])
+        return w, l, mean
+
+    def save(self, path=SUMMARY_FILE):
+        self.frame().to_csv(path, index=False)
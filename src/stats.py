@@ -0,0 +1,25 @@
+# stats.py - Confidence intervals shared by the optimiser and steady-state runs
+
+import math
+
+# Two-sided 95% Student-t critical values by degrees of freedom (1..30)
+_T95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+
+
+def t_critical(df):
+    """95% two-sided Student-t quantile (normal approximation beyond 30 dof)."""
+    if df < 1:
+        return math.inf
+    return _T95[df - 1] if df <= len(_T95) else 1.96
+
+
+def mean_ci(samples):
+    """Returns (mean, 95% confidence half-width) of samples."""
+    n = len(samples)
+    mean = sum(samples) / n
+    if n < 2:
+        return mean, math.inf
+    var = sum((x - mean) ** 2 for x in samples) / (n - 1)
+    return mean, t_critical(n - 1) * math.sqrt(var / n)
@@ -0,0 +1,389 @@
+# udp.py - The ARQ layers over real localhost UDP sockets, through an impairment proxy
+
+import argparse
+import asyncio
+import multiprocessing
+import random
+import socket
+import struct
+import time
+import zlib
+from collections import deque
+
+from config import DEFAULT_PARAMS
+from layers.link import LinkLayer
+from layers.physical import PhysicalLayer
+from layers.transport import TransportLayer
+from layers.window import RecvWindow
+from models import FRAME_HEADER, SEGMENT_HEADER, Frame, Segment
+
+SACK_HEADER = struct.Struct('!I')  # ACK payload: cumulative ACK, then the SACK bitmap
+SOCKET_BUFFER = 4 * 1024 * 1024    # Requested SO_RCVBUF/SO_SNDBUF (the kernel may cap it)
+TIMER_GUARD = 0.001                # Fire just past a deadline; asyncio timers may run early
+# Added to every RTO (as LinkLayer's max_ack_delay): ACKs of one window burst return spread
+# out by event-loop and socket scheduling, which the RTT deviation alone does not cover
+ACK_JITTER = 0.010
+CLOCK_RESOLUTION = time.get_clock_info("monotonic").resolution
+LOCALHOST = "127.0.0.1"
+
+
+def _enlarge_buffers(endpoint):
+    """Asks for large socket buffers, so a full window burst is not dropped locally."""
+    sock = endpoint.get_extra_info("socket")
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER)
+        except OSError:
+            pass
+
+
+class ImpairmentProxy(asyncio.DatagramProtocol):
+    """
+    Relays datagrams between the sender and the receiver like SimulationEngine's channel.
+    Frames from the sender are delayed by forward_prop_delay + processing_delay and pass
+    the Gilbert-Elliot channel of a PhysicalLayer; a corrupted frame is still delivered
+    with one payload bit flipped, so it is the receiver's CRC check that rejects it.
+    Datagrams from the receiver (ACKs) are delayed by reverse_prop_delay + processing_delay
+    and never corrupted, as in the simulation. line_rate=True also serializes frames at
+    bit_rate; otherwise the proxy adds no rate limit, so the sender's CPU is the ceiling.
+    Delays are constant per direction, so each direction is a FIFO with one timer.
+    """
+    def __init__(self, receiver_addr, seed=None, params=DEFAULT_PARAMS, line_rate=False):
+        self.receiver_addr = receiver_addr
+        self.sender_addr = None
+        self.params = params
+        self.line_rate = line_rate
+        self.phy = PhysicalLayer(seed=seed, params=params)
+        self.rng = random.Random(seed)  # Corrupted bit positions (keeps phy's stream intact)
+        self.link_free_time = 0.0
+        self.forward = deque()  # (due time, datagram, destination)
+        self.reverse = deque()
+        self.frames = 0
+        self.corrupted = 0
+        self.acks = 0
+
+    def connection_made(self, transport):
+        self.endpoint = transport
+        self.loop = asyncio.get_running_loop()
+        _enlarge_buffers(transport)
+
+    def datagram_received(self, data, addr):
+        now = self.loop.time()
+        params = self.params
+        if addr == self.receiver_addr:
+            if self.sender_addr is None:
+                return
+            self.acks += 1
+            delay = params.reverse_prop_delay + params.processing_delay
+            if self.line_rate:
+                delay += params.tx_delay(len(data))
+            self._enqueue(self.reverse, now + delay, data, self.sender_addr)
+            return
+
+        self.sender_addr = addr
+        self.frames += 1
+        delay = params.forward_prop_delay + params.processing_delay
+        if self.line_rate:
+            start = max(now, self.link_free_time)
+            self.link_free_time = start + params.tx_delay(len(data))
+            due = self.link_free_time + delay
+        else:
+            due = now + delay
+        if self.phy.check_error(len(data)):
+            self.corrupted += 1
+            data = self._corrupt(data)
+        self._enqueue(self.forward, due, data, self.receiver_addr)
+
+    def _corrupt(self, data):
+        """Flips one bit of the frame's payload (past both headers)."""
+        headers = FRAME_HEADER.size + SEGMENT_HEADER.size
+        if len(data) <= headers:
+            return data
+        corrupted = bytearray(data)
+        corrupted[self.rng.randrange(headers, len(data))] ^= 1 << self.rng.randrange(8)
+        return corrupted
+
+    def _enqueue(self, queue, due, data, addr):
+        queue.append((due, data, addr))
+        if len(queue) == 1:
+            self.loop.call_at(due, self._release, queue)
+
+    def _release(self, queue):
+        """Sends every queued datagram that is due, then waits for the next one."""
+        now = self.loop.time() + CLOCK_RESOLUTION
+        sendto = self.endpoint.sendto
+        while queue and queue[0][0] <= now:
+            _, data, addr = queue.popleft()
+            sendto(data, addr)
+        if queue:
+            self.loop.call_at(queue[0][0], self._release, queue)
+
+
+async def _serve_proxy(conn, receiver_addr, seed, params, line_rate):
+    loop = asyncio.get_running_loop()
+    endpoint, proxy = await loop.create_datagram_endpoint(
+        lambda: ImpairmentProxy(receiver_addr, seed, params, line_rate), local_addr=(LOCALHOST, 0))
+    cpu_start = time.process_time()
+    stopped = loop.create_future()
+
+    def stop():
+        loop.remove_reader(conn.fileno())
+        conn.recv()
+        stopped.set_result(None)
+
+    loop.add_reader(conn.fileno(), stop)
+    conn.send(endpoint.get_extra_info("sockname"))
+    await stopped
+    endpoint.close()
+    conn.send({"proxy_cpu_seconds": time.process_time() - cpu_start, "frames_relayed": proxy.frames,
+               "frames_corrupted": proxy.corrupted, "acks_relayed": proxy.acks})
+
+
+def _proxy_main(conn, receiver_addr, seed, params, line_rate):
+    """Proxy process: relays until the parent sends anything on conn, then reports its counters."""
+    asyncio.run(_serve_proxy(conn, receiver_addr, seed, params, line_rate))
+
+
+class UdpSender(asyncio.DatagramProtocol):
+    """
+    Sending side: a TransportLayer segments the data and caches per-segment CRC32s, and
+    a LinkLayer runs Selective Repeat with selective ACKs and adaptive timeouts on the
+    loop's clock. Frames leave as soon as the window allows (the socket is the link);
+    holes an ACK reveals and expired timers are retransmitted at once.
+    Every frame carries its transmission time, which the receiver echoes in its SACK.
+    """
+    def __init__(self, data, W, L, params=DEFAULT_PARAMS):
+        self.transport_layer = TransportLayer(L, params=params)
+        self.segments = self.transport_layer.segmentize(data)
+        self.total_segments = len(self.segments)
+        self.link = LinkLayer(W, max_ack_delay=ACK_JITTER)
+        self.next_seg_idx = 0
+        self.retransmit_queue = deque()
+        self.retransmit_queued = set()
+        self.timer = None
+        self.done = asyncio.get_running_loop().create_future()
+
+        self.frames_sent = 0
+        self.retransmissions = 0
+        self.rtt_samples = []
+
+    def connection_made(self, transport):
+        self.endpoint = transport
+        self.loop = asyncio.get_running_loop()
+        _enlarge_buffers(transport)
+        self._pump()
+
+    def datagram_received(self, data, addr):
+        now = self.loop.time()
+        ack = Frame.unpack(data)
+        cum_ack, = SACK_HEADER.unpack_from(ack.payload)
+        sack_bits = int.from_bytes(ack.payload[SACK_HEADER.size:], "big")
+
+        rtt_sample = self.link.rtt_sample(ack.seq_num, now)
+        if rtt_sample is not None:
+            self.rtt_samples.append(rtt_sample)
+        for lost in self.link.process_sack(ack.seq_num, ack.timestamp, cum_ack, sack_bits, now):
+            self._queue_retransmit(lost)
+        self._pump()
+
+    def _queue_retransmit(self, seq):
+        if seq not in self.retransmit_queued:
+            self.retransmit_queued.add(seq)
+            self.retransmit_queue.append(seq)
+
+    def _pump(self):
+        """Sends the queued retransmissions, then new segments while the window is open."""
+        now = self.loop.time()
+        link, queue = self.link, self.retransmit_queue
+        while queue:
+            seq = queue.popleft()
+            self.retransmit_queued.discard(seq)
+            if link.is_unacked(seq):
+                self.retransmissions += 1
+                self._send(link.prepare_retransmit(seq, now), now)
+
+        while self.next_seg_idx < self.total_segments and link.can_send():
+            segment = self.segments[self.next_seg_idx]
+            segment.checksum = self.transport_layer.segment_checksum(segment.seq_num, segment.data)
+            self._send(link.create_frame(segment, now), now)
+            self.next_seg_idx += 1
+
+        if self.next_seg_idx >= self.total_segments and link.all_acked():
+            if self.timer is not None:
+                self.timer.cancel()
+            if not self.done.done():
+                self.done.set_result(now)
+            return
+        self._arm_timer()
+
+    def _send(self, frame, now):
+        frame.timestamp = now
+        self.endpoint.sendto(frame.pack())
+        self.frames_sent += 1
+
+    def _arm_timer(self):
+        """Arms one loop timer for the earliest retransmission deadline, unless an earlier one is set."""
+        deadline = self.link.next_timeout()
+        if deadline is None:
+            return
+        when = deadline + TIMER_GUARD
+        if self.timer is not None:
+            if self.timer.when() <= when:
+                return
+            self.timer.cancel()
+        self.timer = self.loop.call_at(when, self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        for seq in self.link.get_timed_out_frames(self.loop.time()):
+            self._queue_retransmit(seq)
+        self._pump()
+
+
+class UdpReceiver(asyncio.DatagramProtocol):
+    """
+    Receiving side: frames failing their CRC32 are dropped, the rest go through the
+    LinkLayer's reorder window into the receive ring it shares with the TransportLayer
+    (as in SimulationEngine), and every frame is answered with a selective ACK. The
+    application reads each in-order segment as soon as it arrives and keeps a CRC32
+    of the whole delivered stream, so the transfer can be checked end to end.
+    """
+    def __init__(self, W, L, total_segments, params=DEFAULT_PARAMS):
+        self.receive_window = RecvWindow(W, W + params.receiver_buffer_size // L + 1,
+                                         params.receiver_buffer_size, L)
+        self.transport_layer = TransportLayer(L, params=params, receive_window=self.receive_window)
+        self.link = LinkLayer(W, recv_buffer=self.receive_window)
+        self.total_segments = total_segments
+        self.bitmap_bytes = (W + 7) // 8
+        self.done = asyncio.get_running_loop().create_future()
+
+        self.crc_failures = 0
+        self.acks_sent = 0
+        self.delivered_bytes = 0
+        self.stream_crc = 0
+
+    def connection_made(self, transport):
+        self.endpoint = transport
+        self.loop = asyncio.get_running_loop()
+        _enlarge_buffers(transport)
+
+    def datagram_received(self, data, addr):
+        frame = Frame.unpack(data)
+        segment = Segment.unpack(frame.payload)
+        if not self.transport_layer.verify_integrity(segment.data, segment.checksum):
+            self.crc_failures += 1
+            return
+
+        in_order, ack_seq = self.link.receive_frame(frame.seq_num, segment.data, segment.checksum)
+        if in_order:
+            self._read()
+
+        cum_ack, sack_bits = self.link.sack()
+        ack = Frame(ack_seq, "ACK", SACK_HEADER.pack(cum_ack) + sack_bits.to_bytes(self.bitmap_bytes, "big"),
+                    frame.timestamp)
+        self.endpoint.sendto(ack.pack(), addr)
+        self.acks_sent += 1
+
+    def _read(self):
+        """The application: reads every in-order segment out of the receive ring."""
+        rb = self.receive_window
+        capacity, payloads, crc = rb.capacity, rb.payloads, self.stream_crc
+        for seq in range(rb.read_base, rb.base):
+            crc = zlib.crc32(payloads[seq % capacity], crc)
+        self.stream_crc = crc
+        self.delivered_bytes += self.transport_layer.app_consume(rb.ready_bytes)
+        if rb.read_base >= self.total_segments and not self.done.done():
+            self.done.set_result(self.loop.time())
+
+
+async def run_transfer(data, W, L, seed=0, params=DEFAULT_PARAMS, line_rate=False, timeout=300.0):
+    """
+    Transfers data from a UdpSender to a UdpReceiver (both in this process) through an
+    ImpairmentProxy in a child process, and returns wall-clock and CPU statistics.
+    cpu_seconds covers this process (both protocol endpoints and the event loop);
+    the proxy's own CPU time is reported separately.
+    """
+    loop = asyncio.get_running_loop()
+    total_segments = -(-len(data) // L)
+    receiver_endpoint, receiver = await loop.create_datagram_endpoint(
+        lambda: UdpReceiver(W, L, total_segments, params), local_addr=(LOCALHOST, 0))
+
+    conn, child_conn = multiprocessing.Pipe()
+    proxy = multiprocessing.Process(target=_proxy_main, daemon=True,
+                                    args=(child_conn, receiver_endpoint.get_extra_info("sockname"),
+                                          seed, params, line_rate))
+    proxy.start()
+    sender_endpoint = None
+    try:
+        proxy_addr = await loop.run_in_executor(None, conn.recv)
+
+        cpu_start = time.process_time()
+        start = loop.time()
+        sender_endpoint, sender = await loop.create_datagram_endpoint(
+            lambda: UdpSender(data, W, L, params), remote_addr=proxy_addr)
+        finish, _ = await asyncio.wait_for(asyncio.gather(receiver.done, sender.done), timeout)
+        cpu_seconds = time.process_time() - cpu_start
+
+        conn.send("stop")
+        proxy_stats = await loop.run_in_executor(None, conn.recv)
+    finally:
+        if sender_endpoint is not None:
+            sender_endpoint.close()
+        receiver_endpoint.close()
+        proxy.join(timeout=5)
+        if proxy.is_alive():
+            proxy.terminate()
+
+    wall_time = finish - start
+    megabytes = len(data) / 2**20
+    return {
+        "W": W, "L": L, "seed": seed,
+        "wall_time": wall_time,
+        "goodput_bps": len(data) * 8 / wall_time,
+        "cpu_seconds": cpu_seconds,
+        "cpu_per_mb": cpu_seconds / megabytes,
+        "proxy_cpu_per_mb": proxy_stats["proxy_cpu_seconds"] / megabytes,
+        "frames_sent": sender.frames_sent,
+        "retransmissions": sender.retransmissions,
+        "avg_rtt": sum(sender.rtt_samples) / len(sender.rtt_samples) if sender.rtt_samples else 0.0,
+        "crc_failures": receiver.crc_failures,
+        "acks_sent": receiver.acks_sent,
+        "intact": receiver.delivered_bytes == len(data) and receiver.stream_crc == zlib.crc32(data),
+        **proxy_stats,
+    }
+
+
+def run(data, W, L, **options):
+    """Synchronous wrapper of run_transfer."""
+    return asyncio.run(run_transfer(data, W, L, **options))
+
+
+if __name__ == "__main__":
+    from main import parse_params
+
+    parser = argparse.ArgumentParser(description="Selective Repeat ARQ over localhost UDP with an impairment proxy")
+    parser.add_argument("-W", type=int, nargs="+", default=[32], help="window sizes")
+    parser.add_argument("-L", type=int, nargs="+", default=[1024], help="segment payload sizes (bytes)")
+    parser.add_argument("--size", type=float, default=8.0, metavar="MB", help="transfer size in MiB")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the proxy's Gilbert-Elliot channel")
+    parser.add_argument("--line-rate", action="store_true",
+                        help="serialize frames at the configured bit rate (default: delays and errors only)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="wall-clock limit per transfer (seconds)")
+    parser.add_argument("--set", nargs="+", default=[], metavar="NAME=VALUE",
+                        help="override channel parameters, e.g. ber_bad=1e-3 forward_prop_delay=0.02")
+    args = parser.parse_args()
+    try:
+        params = parse_params(args.set)
+    except ValueError as e:
+        parser.error(str(e))
+
+    data = random.Random(args.seed).randbytes(int(args.size * 2**20))
+    for w in args.W:
+        for l in args.L:
+            stats = run(data, w, l, seed=args.seed, params=params, line_rate=args.line_rate,
+                        timeout=args.timeout)
+            print(f"W={w}, L={l}: {stats['goodput_bps'] / 1e6:.2f} Mbps in {stats['wall_time']:.2f} s | "
+                  f"CPU {stats['cpu_per_mb'] * 1e3:.1f} ms/MB (proxy {stats['proxy_cpu_per_mb'] * 1e3:.1f} ms/MB) | "
+                  f"retransmissions {stats['retransmissions']}, corrupted {stats['frames_corrupted']}, "
+                  f"CRC failures {stats['crc_failures']}, avg RTT {stats['avg_rtt'] * 1e3:.1f} ms"
+                  + ("" if stats["intact"] else " | DATA MISMATCH"))
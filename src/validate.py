@@ -0,0 +1,51 @@
+# validate.py - Cross-checks between equivalent simulation modes
+
+import sys
+
+import numpy as np
+from engine import SimulationEngine
+
+# (W, L) points covering small/large windows and payloads
+VALIDATION_POINTS = [(2, 128), (8, 512), (32, 1024), (64, 4096)]
+VALIDATION_SEEDS = (0, 1, 2)
+VALIDATION_DATA_SIZE = 2 * 1024 * 1024  # 2 MB
+
+
+def run_stats(W, L, seed, total_data, **engine_kwargs):
+    """Runs one simulation and returns every statistic reported in the results rows."""
+    engine = SimulationEngine(W=W, L=L, seed=seed, **engine_kwargs)
+    total_time = engine.run(total_data)
+    return {
+        "total_time": total_time,
+        "retransmissions": engine.retransmissions,
+        "avg_rtt": engine.avg_rtt,
+        "utilization": engine.utilization,
+        "buffer_events": engine.buffer_events,
+        "delayed_acks": engine.delayed_acks,
+    }
+
+
+def compare_payload_modes(points=VALIDATION_POINTS, seeds=VALIDATION_SEEDS,
+                          data_size=VALIDATION_DATA_SIZE):
+    """
+    Runs every point with real payload bytes and payload-free, and returns the
+    list of (W, L, seed, full_stats, abstract_stats) that differ.
+    """
+    payload = np.random.bytes(data_size)
+    mismatches = []
+    for W, L in points:
+        for seed in seeds:
+            full = run_stats(W, L, seed, payload)
+            abstract = run_stats(W, L, seed, data_size)
+            if full != abstract:
+                mismatches.append((W, L, seed, full, abstract))
+    return mismatches
+
+
+if __name__ == "__main__":
+    mismatches = compare_payload_modes()
+    for W, L, seed, full, abstract in mismatches:
+        print(f"MISMATCH W={W}, L={L}, Seed={seed}:\n  payload:  {full}\n  abstract: {abstract}")
+    if mismatches:
+        sys.exit(1)
+    print("Payload and abstract modes produce identical statistics.")